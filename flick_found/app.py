@@ -1,93 +1,96 @@
 import os
-import requests
-import openai
-from openai import OpenAI
 import json
-from flask import Flask, render_template, url_for, flash, redirect, request, session
+from flask import Flask, Blueprint, render_template, url_for, flash, redirect, request, session, jsonify, abort, make_response, send_file
 from forms import RegistrationForm, LoginForm
+from models import db, upsert, User, RecommendedMovies, GenrePreferences, MoviePreferences, RecommendationJob
+from recommender import MAX_RECOMMENDATION_COUNT, RECOMMENDATION_COUNT, is_valid_recommendation, modify_database
+from jobs import init_jobs, submit_job
+from enrichment import init_enrichment
+from recommendation_cache import get_cached_recommendations
+from similarity import LOCAL_RECOMMENDATIONS, recommend_similar
+from poster_cache import lookup_posters
+from poster_files import is_poster_name, get_poster_file
+from tmdb import POSTER_SIZES, TMDBError, image_url
+from upcoming import upcoming_feed
+from genres import genre_mask
+from profiles import load_profile, get_profile, invalidate_profile
+from instrumentation import init_instrumentation
+from import_profile import importtime_command
+from password_hashing import HashingBusy, admit_login
+from page_cache import cached_fragment, latest_recommendation, page_etag
+import metrics
 from flask_behind_proxy import FlaskBehindProxy
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_migrate import Migrate, upgrade
 from dotenv import load_dotenv
 from functools import wraps
-import re
-from sqlalchemy import desc
-
-
-# Google API imports
-import datetime
 from datetime import datetime
-from zoneinfo import ZoneInfo
-from tzlocal import get_localzone
-import os.path
-import urllib3
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-
-
-SCOPES = ['https://www.googleapis.com/auth/calendar',
-          'https://www.googleapis.com/auth/calendar.events']
-
-app = Flask(__name__)
-proxied = FlaskBehindProxy(app)
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default_secret_key')
-
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-
-
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(60), nullable=False)
-
-    genre_preferences = db.relationship('GenrePreferences', backref='user', lazy=True)
-    movie_preferences = db.relationship('MoviePreferences', backref='user', lazy=True)
-
-    def set_password(self, password):
-        self.password = generate_password_hash(password)
-
-    def check_password(self, password):
-        return check_password_hash(self.password, password)
-
-    def __repr__(self):
-        return f"User('{self.email}')"
-
-
-class RecommendedMovies(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    title = db.Column(db.String(120), nullable=False)
-    release_date = db.Column(db.String(15), nullable=False)
-    rating = db.Column(db.Integer, nullable=False)
-    genre = db.Column(db.String(120), nullable=False)
-
-
-class GenrePreferences(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    genre = db.Column(db.String(20), nullable=False)  # Assuming storing genre as a string
-
-    def __repr__(self):
-        return f"Genre_Preferences(user_id={self.user_id}, genre={self.genre})"
+from sqlalchemy import desc
+from werkzeug.http import is_resource_modified
+
+
+# Google Calendar; the Google client libraries load with the first reminder
+from calendar_client import (init_calendar, reminder_event, insert_reminders, forget_calendar_service,
+                             CalendarRequestFailed)
+
+
+main = Blueprint('main', __name__)
+migrate = Migrate()
+
+TOO_MANY_ATTEMPTS = 'Too many attempts. Please wait a minute and try again.'
+HASHING_BUSY = 'We are busy right now. Please try again in a moment.'
+# Recommendations per page of /results and /api/recommendations
+RESULTS_PAGE_SIZE = int(os.getenv('RESULTS_PAGE_SIZE', 30))
+MAX_PAGE_SIZE = 100
+# How long browsers reuse a card's poster redirect
+POSTER_REDIRECT_MAX_AGE = 7 * 24 * 3600
+# TMDB size of the posters shown on cards
+CARD_POSTER_SIZE = os.getenv('CARD_POSTER_SIZE', 'w342')
+# A TMDB poster path never changes content, so proxied images are cached for a year
+POSTER_MAX_AGE = 365 * 24 * 3600
+MIGRATIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+
+def database_engine_options(uri):
+    # SQLite connections are cheap and file-locked, so only server databases
+    # get a sized connection pool
+    if uri.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True
+    }
 
 
-class MoviePreferences(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    movie = db.Column(db.String(100), nullable=False)  # Can be adjusted we have long*** movie titles
+def create_app(config=None):
+    # Builds the app without touching the database schema; run
+    # `flask --app app db upgrade` (or upgrade_database()) before serving
+    app = Flask(__name__)
+    FlaskBehindProxy(app)
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default_secret_key')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///site.db')
+    # Behind nginx/Apache, let the web server send poster files itself
+    app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE') == '1'
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                          database_engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
 
-    def __repr__(self):
-        return f"Movie_Preferences(user_id={self.user_id}, genre={self.movie})"
+    db.init_app(app)
+    migrate.init_app(app, db, directory=MIGRATIONS_DIRECTORY, render_as_batch=True)
+    init_instrumentation(app)
+    app.register_blueprint(main)
+    init_jobs(app)
+    init_enrichment(app)
+    init_calendar(app)
+    app.cli.add_command(importtime_command)
+    return app
 
 
-with app.app_context():
-    db.create_all()
+def upgrade_database(app):
+    with app.app_context():
+        upgrade(directory=MIGRATIONS_DIRECTORY)
 
 
 # @app.route("/")
@@ -100,65 +103,86 @@ with app.app_context():
 # def second_page():
 #     return render_template('about.html', subtitle='about', text='This is the second page!')
 def save_genre_preferences(user_id: int, genres: list[str]):
-    for genre in genres:
-        # Added it to do lower so that it works this way
-        db.session.add(GenrePreferences(user_id=user_id, genre=genre.lower()))
+    # Added it to do lower so that it works this way
+    genres = dict.fromkeys(genre.strip().lower() for genre in genres if genre.strip())
+    upsert(GenrePreferences, [{'user_id': user_id, 'genre': genre, 'genre_mask': genre_mask(genre)} for genre in genres],
+           ['user_id', 'genre'])
     db.session.commit()
     print(f'Genre preferences saved for User:{user_id}')
 
 
 def save_movie_preferences(user_id, movie_choices):
-    for movie in movie_choices:
-        db.session.add(MoviePreferences(user_id=user_id, movie=movie))
+    movies = dict.fromkeys(movie.strip() for movie in movie_choices if movie.strip())
+    upsert(MoviePreferences, [{'user_id': user_id, 'movie': movie} for movie in movies], ['user_id', 'movie'])
     db.session.commit()
     print(f'Movie preferences saved for User:{user_id}')
 
 
-@app.route("/register", methods=['GET', 'POST'])
+@main.route("/register", methods=['GET', 'POST'])
 def register():
     form = RegistrationForm()
     if form.validate_on_submit():  
+        if not admit_login(request.remote_addr, form.email.data):
+            flash(TOO_MANY_ATTEMPTS, 'danger')
+            return render_template('register.html', title='Register', form=form), 429
         existing_user = User.query.filter_by(email=form.email.data).first()
         if existing_user:
             flash('Email already taken. Please use a different email.', 'danger')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
         user = User(email=form.email.data)
-        user.set_password(form.password.data)
+        try:
+            user.set_password(form.password.data)
+        except HashingBusy:
+            flash(HASHING_BUSY, 'danger')
+            return render_template('register.html', title='Register', form=form), 503
         db.session.add(user)
         db.session.commit()
         flash(f'Account created for {form.email.data}!', 'success')
-        return redirect(url_for('login'))  
+        return redirect(url_for('main.login'))  
     return render_template('register.html', title='Register', form=form)
 
 
-@app.route('/')
+@main.route('/')
 def root():
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
-@app.route("/login", methods=['GET', 'POST'])
+@main.route("/login", methods=['GET', 'POST'])
 def login():
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(email=form.email.data).first()
-        if user and user.check_password(form.password.data):
+        # Each attempt costs a slow password hash, so clients guessing
+        # passwords are turned away before one is computed
+        if not admit_login(request.remote_addr, form.email.data):
+            flash(TOO_MANY_ATTEMPTS, 'danger')
+            return render_template('login.html', title='Login', form=form), 429
+        user, profile = load_profile(User.email == form.email.data)
+        try:
+            valid = user and user.check_password(form.password.data)
+        except HashingBusy:
+            flash(HASHING_BUSY, 'danger')
+            return render_template('login.html', title='Login', form=form), 503
+        if valid:
+            if db.session.dirty:
+                # check_password upgraded an old hash
+                db.session.commit()
             session['user_id'] = user.id
+            session['profile'] = profile
             flash(f'Login successful for {form.email.data}', 'success')
-            genre_preference_count = GenrePreferences.query.filter_by(user_id=user.id).count()
-            movie_preference_count = MoviePreferences.query.filter_by(user_id=user.id).count()
-            if genre_preference_count == 0 or movie_preference_count == 0:
-                return redirect(url_for('preferences'))
-            return redirect(url_for('results'))
+            if not profile['genres'] or not profile['has_movies']:
+                return redirect(url_for('main.preferences'))
+            return redirect(url_for('main.results'))
         else:
             flash('Login Unsuccessful. Please check email and password', 'danger')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
     return render_template('login.html', title='Login', form=form)
 
 
-@app.route("/logout")
+@main.route("/logout")
 def logout():
     session.pop('user_id', None)
+    invalidate_profile()
     flash('You have been logged out.', 'info')
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
 
 def login_required(f):
@@ -166,272 +190,249 @@ def login_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             flash('Please log in to access this page.', 'warning')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         return f(*args, **kwargs)
 
     return decorated_function
 
 
-# API configuration
-TMDB_API_KEY = os.environ.get('TMDB_API_KEY')
-OPENAI_API_KEY = os.environ.get('OPENAI_KEY')
-TMDB_BASE_URL = 'https://api.themoviedb.org/3'
-openai.api_key = OPENAI_API_KEY
-
-
-def get_matched_upcoming_movies():
-    genres = {
-        28: "action",
-        12: "adventure",
-        16: "animation",
-        35: "comedy",
-        80: "crime",
-        99: "documentary",
-        18: "drama",
-        10751: "family",
-        14: "fantasy",
-        36: "history",
-        27: "horror",
-        10402: "music",
-        9648: "mystery",
-        10749: "romance",
-        878: "scifi",
-        10770: "tv movie",
-        53: "thriller",
-        10752: "war",
-        37: "western"
-    }
-
-    def normalize_genre_name(name):
-        return re.sub(r'\W+', '', name.lower())
-
-    def convert_id_to_genre_name(genre_id):
-        return genres.get(genre_id, "Unknown")
-
-    user_preferred_genres = GenrePreferences.query.filter_by(user_id=session['user_id']).all()
-    preferred_genre_names = {normalize_genre_name(genre_preference.genre) for genre_preference in user_preferred_genres}
-    upcoming_results = []
-
-    url = f'https://api.themoviedb.org/3/movie/upcoming?api_key={TMDB_API_KEY}'
-    response = requests.get(url)
-
-    if response.status_code == 200:
-        upcoming_movies_json = response.json().get('results', [])
-        for movie in upcoming_movies_json:
-            movie_genre_names = {convert_id_to_genre_name(genre_id) for genre_id in movie['genre_ids']}
-            if preferred_genre_names & movie_genre_names:
-                full_genre_list = [convert_id_to_genre_name(genre_id) for genre_id in movie['genre_ids']]
-                movie_entry = {
-                    'title': movie['title'],
-                    'release_date': movie['release_date'],
-                    'rating': movie['vote_average'],
-                    'poster_path': f"https://image.tmdb.org/t/p/w500{movie['poster_path']}",
-                    'genre': ', '.join(full_genre_list)
-                }
-                upcoming_results.append(movie_entry)
-        return upcoming_results
-    else:
-        print(f"Error fetching upcoming movies: {response.status_code}")
-        return []
-
-    # response = requests.get(url, headers=headers) not sure what this does... its unreachable
-
-
-def get_movie_poster(title):
-    search_url = f"{TMDB_BASE_URL}/search/movie"
-    params = {
-        'api_key': TMDB_API_KEY,
-        'query': title
-    }
-    response = requests.get(search_url, params=params)
-    data = response.json()
-    if data['results']:
-        poster_path = data['results'][0].get('poster_path')
-        if poster_path:
-            return f"https://image.tmdb.org/t/p/w500{poster_path}"
-    return None
-
-
-def generate_recommendations(movie_choices, preferences):
-    print("\nProcessing request....")
-    while True:
-        try:
-            client = OpenAI(
-                api_key=OPENAI_API_KEY,
-            )
-            completion = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": f"Please give me a "
-                                                  f"recommendation based on "
-                                                  f"these movies here "
-                                                  f"{movie_choices} "
-                                                  f"and with the genres: "
-                                                  f"{preferences}."},
-
-                    {"role": "user", "content": "You are a movie recommendation bot that takes in similar movies "
-                                                "and gives 30 specific movie recommendations as a response in a json format "
-                                                "with the following keys: title, genre, rating out of 10 from IMDB, release date. "
-                                                "Please provide the recommendations as one json string with the key 'recommendations' "
-                                                "containing a list of 30 movies with their respective attributes. "
-                                                "Use double quotes for all strings. Here is a sample format:\n\n"
-                                                "{\n"
-                                                "  \"recommendations\": [\n"
-                                                "    {\n"
-                                                "      \"title\": \"Movie Title\",\n"
-                                                "      \"genre\": \"Genre\",\n"
-                                                "      \"rating\": \"8.5\",\n"
-                                                "      \"release_date\": \"YYYY-MM-DD\"\n"
-                                                "    },\n"
-                                                "    ... 29 more movies ...\n"
-                                                "  ]\n"
-                                                "}.\n"
-                                                "Please end with a closing curly bracket."
-                     }
-                ]
-            )
-            return json.loads(completion.choices[0].message.content)
-        except json.JSONDecodeError:
-            print("There is a json decode error")
-
-
-def process_response(response):
-    recommendations = response['recommendations']
-    processed_recommendations = []
-    for item in recommendations:
-        processed_recommendations.append({
-            'title': item['title'],
-            'genre': item['genre'],
-            'rating': item['rating'],
-            'release_date': item['release_date']
-        })
-    return processed_recommendations
-
-
-def process_choices_and_recommendations(movie_choices, recommendations):
-    while True:
-        count = 0
-        try:
-            processed_recommendations = process_response(generate_recommendations(movie_choices, recommendations))
-            return processed_recommendations
-        except KeyError:
-            count += 1
-            print(
-                'There was a key error when converting the response to the proper dictionary. Retrying GPT request...')
-            if count > 3:
-                return ''
-
-
-def modify_database(recommendations):
-    user_id = session.get('user_id')
-    if not user_id:
-        print("User ID not found in session.")
-        return
-
-    try:
-        for recommendation in recommendations:
-            title = recommendation.get('title')
-            genre = recommendation.get('genre')
-            rating = recommendation.get('rating')
-            release_date = recommendation.get('release_date')
-
-            if title and genre and rating and release_date:
-                recommend_movie = RecommendedMovies(
-                    title=title, genre=genre, rating=rating, release_date=release_date, user_id=user_id)
-                db.session.add(recommend_movie)
-            else:
-                print(f"Skipping invalid recommendation: {recommendation}")
-
-        db.session.commit()
-        print('Movies successfully added')
-    except Exception as e:
-        db.session.rollback()
-        print(f"An error occurred: {e}")
-
-
-@app.route('/preferences')
+@main.route('/preferences')
 @login_required
 def preferences():
     return render_template('preferences.html')
 
 
-@app.route('/generate', methods=['POST'])
+@main.route('/generate', methods=['POST'])
 @login_required
 def generate():
     movie_choices = request.form.get('choices-hidden').split('`')
     genres = request.form.get('genre-hidden').split('`')
     save_genre_preferences(session['user_id'], genres)
     save_movie_preferences(session['user_id'], movie_choices)
-    recommendations = process_choices_and_recommendations(movie_choices, genres)
-    if recommendations:
-        modify_database(recommendations)
-    else:
-        print('Unable to process API Request and Convert to DB')
-
-    return redirect(url_for('results'))
-
-@app.route('/results')
+    invalidate_profile()
+    # How many recommendations to make, optionally chosen by the client
+    count = min(max(request.form.get('count', RECOMMENDATION_COUNT, type=int), 1), MAX_RECOMMENDATION_COUNT)
+    cached = get_cached_recommendations(movie_choices, genres)
+    if cached and len(cached) >= count:
+        saved = modify_database(cached[:count], session['user_id'])
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify(status='done', saved=saved)
+        return redirect(url_for('main.results'))
+    # Similar movies we already know about are shown straight away, and
+    # OpenAI is only asked for the rest
+    local = recommend_similar(session['user_id'], movie_choices, genres, min(LOCAL_RECOMMENDATIONS, count))
+    saved = modify_database(local, session['user_id']) if local else 0
+    if saved >= count:
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify(status='done', saved=saved)
+        return redirect(url_for('main.results'))
+    # The OpenAI request runs in the background; the results page polls
+    # /jobs/<id> until it finishes
+    job = submit_job(session['user_id'], movie_choices, genres, count - saved,
+                     [rec for rec in local if is_valid_recommendation(rec)])
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(job_id=job.id, status=job.status, status_url=url_for('main.job_status', job_id=job.id)), 202
+    return redirect(url_for('main.results', job=job.id))
+
+
+@main.route('/jobs/<int:job_id>')
 @login_required
-def results():
-    if 'user_id' not in session:
-        print('ERROR')
+def job_status(job_id):
+    job = db.session.get(RecommendationJob, job_id)
+    if job is None or job.user_id != session['user_id']:
+        abort(404)
+    return jsonify(job_id=job.id, status=job.status, saved=job.saved, error=job.error)
+
+
+def recommendation_page(user_id, mask, before=None, limit=RESULTS_PAGE_SIZE):
+    # Keyset pagination: a page is the newest `limit` recommendations with an
+    # id below the cursor, read straight off the (user_id, id) index however
+    # deep the history goes. Returns the rows and the cursor of the next
+    # page, or None on the last one.
     recommendations = RecommendedMovies.query \
-    .filter_by(user_id=session['user_id']) \
+    .filter_by(user_id=user_id)
+    if mask:
+        recommendations = recommendations.filter(RecommendedMovies.genre_mask.op('&')(mask) != 0)
+    if before:
+        recommendations = recommendations.filter(RecommendedMovies.id < before)
+    recommendations = recommendations \
     .order_by(desc(RecommendedMovies.id)) \
-    .limit(30) \
+    .limit(limit + 1) \
     .all()
+    if len(recommendations) > limit:
+        return recommendations[:limit], recommendations[limit - 1].id
+    return recommendations, None
+
 
-    for rec in recommendations:
-        rec.poster = get_movie_poster(rec.title)
-    upcoming_movies = get_matched_upcoming_movies()
+def render_recommendation_cards(user_id, mask, genre):
+    recommendations, cursor = recommendation_page(user_id, mask)
+    next_url = cursor and url_for('main.recommendations_api', before=cursor, genre=genre)
+    return render_template('_recommendation_cards.html', recommendations=recommendations, next_url=next_url)
 
-    return render_template('results.html',
-                           # recommendations is a queryObject, upcoming is a Dict
-                           recommendations=recommendations, upcoming_movies=upcoming_movies)
 
-@app.route('/watchlist', methods=['GET', 'POST'])
+@main.route('/results')
+@login_required
+def results():
+    if 'user_id' not in session:
+        print('ERROR')
+    user_id = session['user_id']
+    # /watchlist sends a genre to narrow the list down to
+    mask = genre_mask(request.args.get('genre'))
+    profile_mask = get_profile(user_id)['genre_mask']
+    latest = latest_recommendation(user_id)
+    feed = upcoming_feed.snapshot()
+
+    # The page only changes when the user gets new recommendations or the
+    # upcoming feed is refreshed, so reloads are answered with a 304 before
+    # anything is queried or rendered. Pages polling a job or showing flash
+    # messages are one-offs and are always rendered.
+    conditional = 'job' not in request.args and not session.get('_flashes')
+    etag = page_etag(user_id, latest.latest_id, latest.enriched_at, feed.version, mask, profile_mask)
+    last_modified = datetime.utcfromtimestamp(int(max(latest.changed_at, feed.fetched_at)))
+    if conditional and not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        metrics.increment('results_not_modified_total')
+        response = make_response('', 304)
+    else:
+        # Card grids are cached as rendered HTML; the recommendations per
+        # user and the upcoming grid per genre mask, shared by every user
+        recommendation_cards = cached_fragment(
+            ('recommendations', user_id, latest.latest_id, latest.enriched_at, mask),
+            lambda: render_recommendation_cards(user_id, mask, request.args.get('genre')))
+        upcoming_cards = cached_fragment(
+            ('upcoming', feed.version, profile_mask),
+            lambda: render_template('_upcoming_movies.html',
+                                    upcoming_movies=upcoming_feed.match(profile_mask, feed)))
+
+        # Job started by /generate that the page should keep polling
+        job = db.session.get(RecommendationJob, request.args.get('job', type=int) or 0)
+        if job is None or job.user_id != user_id or job.status in ('done', 'failed'):
+            job = None
+
+        response = make_response(render_template('results.html', recommendation_cards=recommendation_cards,
+                                                 upcoming_cards=upcoming_cards, job=job))
+    if conditional:
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # Browsers keep the page but check back with the ETag on every view
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
+
+@main.route('/api/recommendations')
+@login_required
+def recommendations_api():
+    # Older pages of the results page. Takes the cursor from the previous
+    # page's "next" as ?before=, an optional ?genre= and ?limit=.
+    user_id = session['user_id']
+    limit = min(max(request.args.get('limit', RESULTS_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    genre = request.args.get('genre')
+    recommendations, cursor = recommendation_page(user_id, genre_mask(genre), request.args.get('before', type=int),
+                                                  limit)
+    return jsonify(
+        recommendations=[{
+            'id': rec.id,
+            'title': rec.title,
+            'genre': rec.genre,
+            'rating': rec.rating,
+            'release_date': rec.release_date,
+            'poster_url': recommendation_poster_src(rec)
+        } for rec in recommendations],
+        next=cursor,
+        next_url=cursor and url_for('main.recommendations_api', before=cursor, genre=genre, limit=limit)
+    )
+
+
+@main.route('/recommendations/<int:recommendation_id>/poster')
+@login_required
+def recommendation_poster(recommendation_id):
+    # Each card's <img> points here and the browser only requests it once the
+    # card is about to scroll into view, so the page never waits on posters
+    rec = db.session.get(RecommendedMovies, recommendation_id)
+    if rec is None or rec.user_id != session['user_id']:
+        abort(404)
+    if rec.enriched_at:
+        poster = rec.poster_path
+    else:
+        entry = lookup_posters([rec.title])[0]
+        poster = entry and entry.poster_path
+    response = redirect(poster_src(poster) if poster else url_for('static', filename='default_poster.jpg'))
+    response.cache_control.private = True
+    # Missing posters are retried sooner in case TMDB adds one later
+    response.cache_control.max_age = POSTER_REDIRECT_MAX_AGE if poster else 3600
+    return response
+
+
+@main.app_template_global()
+def recommendation_poster_src(recommendation):
+    # Rows enriched from TMDB link straight to their poster; the rest go
+    # through /recommendations/<id>/poster, which looks it up
+    if recommendation.poster_path:
+        return poster_src(recommendation.poster_path)
+    if recommendation.enriched_at:
+        return url_for('static', filename='default_poster.jpg')
+    return url_for('main.recommendation_poster', recommendation_id=recommendation.id)
+
+
+@main.app_template_global()
+def poster_src(poster_path, size=CARD_POSTER_SIZE):
+    # Posters are served from our own cache by /poster rather than hot-linked
+    # from TMDB
+    return url_for('main.poster', tmdb_path=poster_path.lstrip('/'), size=size)
+
+
+@main.route('/poster/<path:tmdb_path>')
+def poster(tmdb_path):
+    # Serves a TMDB poster (?size= one of TMDB's sizes) from the on-disk
+    # cache, downloading it the first time it is asked for
+    size = request.args.get('size', CARD_POSTER_SIZE)
+    if size not in POSTER_SIZES or not is_poster_name(tmdb_path):
+        abort(404)
+    try:
+        poster_file = get_poster_file(size, tmdb_path)
+    except TMDBError as e:
+        if e.status == 404:
+            abort(404)
+        print(f"Unable to fetch poster {size}/{tmdb_path}: {e}")
+        # Let the browser fetch this one straight from TMDB
+        return redirect(image_url(size, tmdb_path))
+    # The content address doubles as the ETag; send_file answers
+    # If-None-Match with a 304 and hands the file to the server's sendfile
+    response = send_file(poster_file.path, mimetype=poster_file.mimetype, etag=poster_file.digest,
+                         max_age=POSTER_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@main.route('/watchlist', methods=['GET', 'POST'])
 @login_required
 def watchlist():
     # TO-DO: Add watchlist functionality
     if request.method == 'POST':
         genre = request.form['genre']
-        return redirect(url_for('results', genre=genre))
+        return redirect(url_for('main.results', genre=genre))
     return render_template('search.html')
 
 
-@app.route('/reminder', methods=['POST'])
+def trusted_reminder_movie(movie_dict):
+    # A movie sent with a recommendationId is one of the user's
+    # recommendations; its reminder uses the release date TMDB gave us rather
+    # than the one on the page. Raises ValueError when there isn't one.
+    recommendation_id = movie_dict.get('recommendationId')
+    if recommendation_id is None:
+        return movie_dict
+    rec = db.session.get(RecommendedMovies, int(recommendation_id))
+    if rec is None or rec.user_id != session['user_id']:
+        raise ValueError(f'Unknown recommendation {recommendation_id}')
+    if rec.tmdb_id is None:
+        raise ValueError(f'No confirmed release date for {rec.title}')
+    return dict(movie_dict, title=rec.title, genre=f'Genre: {rec.genre}', rating=f'Rating: {rec.rating}',
+                releaseDate=f'Release Date: {rec.release_date}')
+
+
+@main.route('/reminder', methods=['POST'])
 @login_required
 def reminder():
-    # Set up connection to GCal and authenticate
-    creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists("token.json"):
-        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                "credentials.json", SCOPES
-            )
-            # Specify a fixed port here
-            creds = flow.run_local_server(port=8080)
-        with open("token.json", "w") as token:
-            token.write(creds.to_json())
-    try:
-        service = build("calendar", "v3", credentials=creds)
-    except Exception:
-        # Name of the file to be deleted
-        filename = "token.json"
-        # Delete the file
-        if os.path.exists(filename):
-            os.remove(filename)
-            print(f"{filename} has been reloaded.")
-        else:
-            print(f"{filename} does not exist.")
-    
     reminder_hidden_key = None
     for key in request.form.keys():
         if key.startswith('reminder-hidden'):
@@ -455,46 +456,57 @@ def reminder():
         print("No valid movie reminders found")
         return "No valid movie reminders", 400
 
-    movie = movie_reminders_list[-1]
-
-    movie_dict = json.loads(movie)
-    timeZone = get_localzone()
-
-    release_date_str = movie_dict['releaseDate'].split(': ')[1]
-    start_datetime_str = release_date_str + "T12:00:00"
-    end_datetime_str = release_date_str + "T14:00:00"
-
+    movie_dict = json.loads(movie_reminders_list[-1])
     try:
-        start_datetime = datetime.fromisoformat(start_datetime_str)
-        end_datetime = datetime.fromisoformat(end_datetime_str)
+        movie_dict = trusted_reminder_movie(movie_dict)
+        event = reminder_event(movie_dict)
     except ValueError as e:
         print("Datetime format error:", e)
         return "Invalid datetime format", 400
 
-    reminder_dict = {
-        "summary": movie_dict['title'],
-        "description": movie_dict['genre'] + movie_dict['rating'],
-        "start": {
-            "dateTime": start_datetime.isoformat(),
-            "timeZone": str(timeZone)
-        },
-        "end": {
-            "dateTime": end_datetime.isoformat(),
-            "timeZone": str(timeZone)
-        },
-        "reminders": {
-            "useDefault": True
-        }
-        }
+    try:
+        _, failed = insert_reminders(session['user_id'], [event])
+    except CalendarRequestFailed as e:
+        print(f"Calendar request failed: {e}")
+        if e.status == 401:
+            # Stored token was revoked; ask the user to authorize again next time
+            forget_calendar_service(session['user_id'])
+        failed = [event['summary']]
+    if failed:
+        flash('Unable to add reminder. Please try again.', 'danger')
+        return redirect(url_for('main.results'))
+
     movie_dict_title = movie_dict['title']
     flash(f'Reminder added for {movie_dict_title}!', 'success')
-    
-    insert_event = service.events().insert(
-            calendarId='primary',
-            body=reminder_dict).execute()
+    return redirect(url_for('main.results'))
+
 
-    return redirect(url_for('results'))
+@main.route('/reminders/batch', methods=['POST'])
+@login_required
+def reminders_batch():
+    # Adds reminders for several movies at once. Takes a JSON body of
+    # {"movies": [{"title", "genre", "rating", "releaseDate"}, ...]}, where a
+    # recommendation can be sent as just {"recommendationId"}
+    movies = (request.get_json(silent=True) or {}).get('movies') or []
+    try:
+        events = [reminder_event(trusted_reminder_movie(movie)) for movie in movies]
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify(error=f'Invalid movie: {e}'), 400
+    if not events:
+        return jsonify(error='No valid movie reminders'), 400
+
+    try:
+        added, failed = insert_reminders(session['user_id'], events)
+    except CalendarRequestFailed as e:
+        if e.status == 401:
+            forget_calendar_service(session['user_id'])
+        return jsonify(error='Calendar request failed'), 502
+    return jsonify(added=added, failed=failed)
 
 
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=8000, debug=True)
\ No newline at end of file
+    # Development server only; production runs gunicorn with gunicorn.conf.py
+    app = create_app()
+    if os.getenv('DB_AUTO_UPGRADE', '1') == '1':
+        upgrade_database(app)
+    app.run(host="0.0.0.0", port=8000, debug=os.getenv("FLASK_DEBUG", "1") == "1")
\ No newline at end of file
@@ -0,0 +1,208 @@
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+# Local stand-ins for TMDB, OpenAI and Google Calendar. Each answers after
+# `latency` seconds (plus up to `jitter` more) and fails with a 500 for
+# `failure_rate` of requests, so the app can be measured without the real
+# APIs and under upstream trouble.
+
+GENRES = ['Action', 'Comedy', 'Drama', 'Horror', 'Romance', 'Sci-Fi', 'Thriller', 'Animation']
+TMDB_GENRE_IDS = [28, 35, 18, 27, 10749, 878, 53, 16]
+
+
+class FakeUpstream:
+    def __init__(self, name, latency=0.0, jitter=0.0, failure_rate=0.0):
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def handle(self, handler):
+        raise NotImplementedError
+
+    def start(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                upstream._serve(self)
+
+            def do_POST(self):
+                upstream._serve(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name=f'fake-{self.name}', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def _serve(self, handler):
+        with self._lock:
+            self.requests += 1
+            failed = random.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+        if failed:
+            send_json(handler, {'error': {'message': f'{self.name} stand-in failure'}}, status=500)
+        else:
+            self.handle(handler)
+
+    def stats(self):
+        return {'requests': self.requests, 'failures': self.failures, 'latency': self.latency,
+                'jitter': self.jitter, 'failure_rate': self.failure_rate}
+
+
+def send_json(handler, body, status=200):
+    data = json.dumps(body).encode()
+    handler.send_response(status)
+    handler.send_header('Content-Type', 'application/json')
+    handler.send_header('Content-Length', str(len(data)))
+    handler.end_headers()
+    handler.wfile.write(data)
+
+
+def read_body(handler):
+    return handler.rfile.read(int(handler.headers.get('Content-Length') or 0))
+
+
+class FakeTMDB(FakeUpstream):
+    def __init__(self, **kwargs):
+        super().__init__('tmdb', **kwargs)
+        self.upcoming = [{
+            'id': 900000 + i,
+            'title': f'Upcoming Movie {i}',
+            'release_date': f'2030-01-{i % 28 + 1:02d}',
+            'vote_average': round(random.uniform(5, 9), 1),
+            'poster_path': f'/upcoming-{i}.jpg',
+            'genre_ids': random.sample(TMDB_GENRE_IDS, 2)
+        } for i in range(20)]
+
+    def handle(self, handler):
+        url = urlparse(handler.path)
+        if url.path.endswith('/movie/upcoming'):
+            send_json(handler, {'results': self.upcoming})
+        elif url.path.endswith('/search/movie'):
+            title = parse_qs(url.query).get('query', [''])[0]
+            send_json(handler, {'results': [{
+                'id': abs(hash(title)) % 10 ** 6, 'title': title, 'poster_path': f'/{uuid.uuid4().hex}.jpg',
+                'release_date': f'20{random.randint(0, 24):02d}-0{random.randint(1, 9)}-1{random.randint(0, 9)}',
+                'vote_average': round(random.uniform(5, 9), 3), 'vote_count': random.randint(10, 5000),
+                'genre_ids': random.sample(TMDB_GENRE_IDS, 2)
+            }]})
+        elif url.path.startswith('/t/p/'):
+            # Poster images; any bytes will do
+            data = b'\xff\xd8\xff\xe0' + url.path.encode() * 256
+            handler.send_response(200)
+            handler.send_header('Content-Type', 'image/jpeg')
+            handler.send_header('Content-Length', str(len(data)))
+            handler.end_headers()
+            handler.wfile.write(data)
+        else:
+            send_json(handler, {'status_message': 'Not found'}, status=404)
+
+
+def fake_recommendations(count):
+    # In the compact reply format recommender.py asks for
+    return [{
+        't': f'Benchmark Movie {uuid.uuid4().hex[:12]}',
+        'g': ', '.join(random.sample(GENRES, 2)),
+        'r': round(random.uniform(5, 9), 1),
+        'd': f'20{random.randint(0, 24):02d}-0{random.randint(1, 9)}-1{random.randint(0, 9)}'
+    } for _ in range(count)]
+
+
+class FakeOpenAI(FakeUpstream):
+    def __init__(self, **kwargs):
+        super().__init__('openai', **kwargs)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def stats(self):
+        # Tokens are estimated at four characters each
+        return dict(super().stats(), prompt_tokens=self.prompt_tokens, completion_tokens=self.completion_tokens)
+
+    def handle(self, handler):
+        request = json.loads(read_body(handler) or b'{}')
+        prompt = ' '.join(message.get('content', '') for message in request.get('messages', []))
+        match = re.search(r'(\d+) movies', prompt)
+        count = int(match.group(1)) if match else 30
+        content = json.dumps({'m': fake_recommendations(count)}, separators=(',', ':'))
+        usage = {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(content) // 4,
+                 'total_tokens': (len(prompt) + len(content)) // 4}
+        with self._lock:
+            self.prompt_tokens += usage['prompt_tokens']
+            self.completion_tokens += usage['completion_tokens']
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        if not request.get('stream'):
+            send_json(handler, {
+                'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()),
+                'model': request.get('model'),
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': content}}],
+                'usage': usage
+            })
+            return
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/event-stream')
+        handler.end_headers()
+        for start in range(0, len(content), 40):
+            chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                     'model': request.get('model'),
+                     'choices': [{'index': 0, 'delta': {'content': content[start:start + 40]},
+                                  'finish_reason': None}]}
+            handler.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+        if request.get('stream_options', {}).get('include_usage'):
+            chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                     'model': request.get('model'), 'choices': [], 'usage': usage}
+            handler.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+        handler.wfile.write(b'data: [DONE]\n\n')
+
+
+class FakeCalendar(FakeUpstream):
+    # Answers the batch endpoint the app uses to insert events; every event
+    # in a batch succeeds
+    def __init__(self, **kwargs):
+        super().__init__('calendar', **kwargs)
+
+    def handle(self, handler):
+        body = read_body(handler).decode()
+        if not handler.path.startswith('/batch'):
+            send_json(handler, {'id': uuid.uuid4().hex, 'status': 'confirmed'})
+            return
+        parts = []
+        for content_id in re.findall(r'Content-ID: <(.+?)>', body):
+            parts.append('--fake_batch\r\n'
+                         'Content-Type: application/http\r\n'
+                         f'Content-ID: <response-{content_id}>\r\n\r\n'
+                         'HTTP/1.1 200 OK\r\n'
+                         'Content-Type: application/json\r\n\r\n'
+                         f'{json.dumps({"id": uuid.uuid4().hex, "status": "confirmed"})}\r\n')
+        data = (''.join(parts) + '--fake_batch--\r\n').encode()
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'multipart/mixed; boundary=fake_batch')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
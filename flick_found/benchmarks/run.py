@@ -0,0 +1,296 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Benchmarks the hot endpoints end to end against local stand-ins for TMDB,
+# OpenAI and Google Calendar. Run from flick_found/:
+#
+#     python benchmarks/run.py --requests 200 --concurrency 8
+#     python benchmarks/run.py --compare benchmarks/results/<earlier run>.json
+#
+# Each run is written to benchmarks/results/ as JSON with throughput,
+# p50/p95/p99 latency and database queries per request for every endpoint.
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from fake_upstreams import FakeCalendar, FakeOpenAI, FakeTMDB  # noqa: E402
+
+ENDPOINTS = ['login', 'generate', 'results', 'results_revalidate', 'reminder']
+SEED_MOVIES = ['The Matrix', 'Inception', 'Alien', 'Heat', 'Amelie', 'Up', 'Se7en', 'Arrival', 'Jaws', 'Rocky']
+SEED_GENRES = ['Action', 'Comedy', 'Drama', 'Horror', 'Romance', 'Sci-Fi', 'Thriller']
+PASSWORD = 'benchmark-password'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark Flick Found against local TMDB/OpenAI stand-ins')
+    parser.add_argument('--requests', type=int, default=100, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=4, help='clients sending requests at once')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='comma separated subset of ' + ', '.join(ENDPOINTS))
+    parser.add_argument('--warmup', type=int, default=5, help='unmeasured requests per endpoint and client')
+    parser.add_argument('--unique-seeds', action='store_true',
+                        help='give every /generate different seeds so the recommendation cache never hits')
+    for name, latency in (('tmdb', 0.05), ('openai', 0.5), ('calendar', 0.1)):
+        parser.add_argument(f'--{name}-latency', type=float, default=latency, help='seconds')
+        parser.add_argument(f'--{name}-jitter', type=float, default=0.0, help='seconds')
+        parser.add_argument(f'--{name}-failure-rate', type=float, default=0.0)
+    parser.add_argument('--background-timeout', type=float, default=600,
+                        help='seconds to wait for jobs and enrichment to finish before the stand-ins stop')
+    parser.add_argument('--output', help='where to write the JSON report')
+    parser.add_argument('--compare', help='earlier JSON report to print the differences against')
+    return parser.parse_args()
+
+
+def start_upstreams(args):
+    upstreams = {}
+    for name, cls in (('tmdb', FakeTMDB), ('openai', FakeOpenAI), ('calendar', FakeCalendar)):
+        upstreams[name] = cls(latency=getattr(args, f'{name}_latency'), jitter=getattr(args, f'{name}_jitter'),
+                              failure_rate=getattr(args, f'{name}_failure_rate')).start()
+    return upstreams
+
+
+def configure_environment(upstreams, database_path, concurrency=4):
+    # Must run before the app is imported: modules read their settings at import
+    os.environ['DATABASE_URL'] = f'sqlite:///{database_path}'
+    # One process serves every client, like a worker with a thread for each
+    os.environ['GUNICORN_THREADS'] = str(2 * concurrency)
+    os.environ['SECRET_KEY'] = 'benchmark'
+    os.environ['TMDB_API_KEY'] = 'benchmark'
+    os.environ['TMDB_BASE_URL'] = upstreams['tmdb'].url + '/3'
+    os.environ['TMDB_IMAGE_BASE_URL'] = upstreams['tmdb'].url + '/t/p/'
+    os.environ['POSTER_FILES_DIR'] = os.path.join(os.path.dirname(database_path), 'poster_files')
+    os.environ['OPENAI_KEY'] = 'benchmark'
+    os.environ['OPENAI_BASE_URL'] = upstreams['openai'].url + '/v1'
+    os.environ['CALENDAR_ROOT_URL'] = upstreams['calendar'].url + '/'
+    # Every simulated user logs in from 127.0.0.1
+    os.environ['LOGIN_IP_RATE_PER_MINUTE'] = os.environ['LOGIN_IP_BURST'] = str(10 ** 9)
+    os.environ['LOGIN_EMAIL_RATE_PER_MINUTE'] = os.environ['LOGIN_EMAIL_BURST'] = str(10 ** 9)
+
+
+class QueryCounter:
+    # Counts the queries each thread runs, so a request served by the test
+    # client in that thread can be attributed its own queries
+    def __init__(self):
+        self._local = threading.local()
+
+    def __call__(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def take(self):
+        count = getattr(self._local, 'count', 0)
+        self._local.count = 0
+        return count
+
+
+def create_users(app, count):
+    from calendar_client import save_credentials
+    from google.oauth2.credentials import Credentials
+    from models import db, User
+
+    emails = [f'bench{i}@example.com' for i in range(count)]
+    with app.app_context():
+        for email in emails:
+            user = User(email=email)
+            user.set_password(PASSWORD)
+            db.session.add(user)
+        db.session.commit()
+        for user in User.query.filter(User.email.in_(emails)):
+            # Valid for the whole run, so reminders never go through OAuth
+            save_credentials(user.id, Credentials(
+                token='benchmark', refresh_token='benchmark', client_id='benchmark', client_secret='benchmark',
+                token_uri='http://127.0.0.1/token', expiry=datetime.utcnow() + timedelta(days=1)))
+    return emails
+
+
+class Client:
+    def __init__(self, app, email, args):
+        self.client = app.test_client()
+        self.email = email
+        self.args = args
+        self.etag = None
+
+    def login(self):
+        return self.client.post('/login', data={'email': self.email, 'password': PASSWORD})
+
+    def generate(self):
+        if self.args.unique_seeds:
+            movies = [f'{random.choice(SEED_MOVIES)} {random.randint(1, 10 ** 9)}' for _ in range(3)]
+        else:
+            movies = random.sample(SEED_MOVIES, 3)
+        return self.client.post('/generate', data={
+            'choices-hidden': '`'.join(movies), 'genre-hidden': '`'.join(random.sample(SEED_GENRES, 2))})
+
+    def results(self):
+        return self.client.get('/results')
+
+    def results_revalidate(self):
+        headers = {'If-None-Match': self.etag} if self.etag else {}
+        response = self.client.get('/results', headers=headers)
+        self.etag = response.headers.get('ETag') or self.etag
+        return response
+
+    def reminder(self):
+        movie = {'title': 'Upcoming Movie 1', 'genre': 'Genre: Action', 'rating': 'Rating: 7.5',
+                 'releaseDate': 'Release Date: 2030-01-02'}
+        return self.client.post('/reminder', data={'reminder-hidden-1': json.dumps(movie) + '`'})
+
+
+def wait_for_background_work(timeout):
+    # Jobs and enrichment batches started by the requests call the stand-ins
+    # too, so they get to finish before the stand-ins stop. They go at the
+    # pace of the rate limits, which can take a few minutes after a long run.
+    import enrichment
+    import jobs
+    deadline = time.monotonic() + timeout
+    reported = 0
+    while jobs.queued_jobs() or enrichment.queued_batches():
+        now = time.monotonic()
+        if now > deadline:
+            print(f'{jobs.queued_jobs()} jobs and {enrichment.queued_batches()} enrichment batches still running; '
+                  'stopping anyway', flush=True)
+            return
+        if now - reported >= 10:
+            print(f'Waiting for {jobs.queued_jobs()} jobs and {enrichment.queued_batches()} enrichment batches...',
+                  flush=True)
+            reported = now
+        time.sleep(0.1)
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))]
+
+
+def run_endpoint(clients, endpoint, total, warmup, counter):
+    for client in clients:
+        for _ in range(warmup):
+            getattr(client, endpoint)()
+    latencies, queries, errors = [], [], []
+    remaining = iter(range(total))
+    lock = threading.Lock()
+
+    def worker(client):
+        counter.take()
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            start = time.perf_counter()
+            response = getattr(client, endpoint)()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                queries.append(counter.take())
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+        'mean_ms': round(1000 * sum(latencies) / len(latencies), 2) if latencies else None,
+        'p50_ms': round(1000 * percentile(latencies, 0.50), 2) if latencies else None,
+        'p95_ms': round(1000 * percentile(latencies, 0.95), 2) if latencies else None,
+        'p99_ms': round(1000 * percentile(latencies, 0.99), 2) if latencies else None,
+        'max_ms': round(1000 * latencies[-1], 2) if latencies else None,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    print(f"\n{'endpoint':<20}{'metric':<22}{'baseline':>12}{'current':>12}{'change':>10}")
+    for endpoint, current in report['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(endpoint)
+        if not previous:
+            continue
+        for metric in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request'):
+            before, after = previous.get(metric), current.get(metric)
+            if before is None or after is None:
+                continue
+            change = f'{100 * (after - before) / before:+.1f}%' if before else 'n/a'
+            print(f'{endpoint:<20}{metric:<22}{before:>12}{after:>12}{change:>10}')
+
+
+def main():
+    args = parse_args()
+    endpoints = [endpoint.strip() for endpoint in args.endpoints.split(',') if endpoint.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        sys.exit(f'Unknown endpoints: {", ".join(sorted(unknown))}')
+
+    upstreams = start_upstreams(args)
+    workdir = tempfile.mkdtemp(prefix='flick-found-bench-')
+    configure_environment(upstreams, os.path.join(workdir, 'bench.db'), args.concurrency)
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from app import create_app, upgrade_database
+
+    app = create_app({'WTF_CSRF_ENABLED': False})
+    upgrade_database(app)
+    counter = QueryCounter()
+    event.listen(Engine, 'after_cursor_execute', counter)
+
+    emails = create_users(app, max(args.users, args.concurrency))
+    clients = [Client(app, emails[i % len(emails)], args) for i in range(args.concurrency)]
+    for client in clients:
+        client.login()
+
+    report = {
+        'created_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'endpoints': {}
+    }
+    for endpoint in endpoints:
+        print(f'Benchmarking {endpoint}...', flush=True)
+        report['endpoints'][endpoint] = run_endpoint(clients, endpoint, args.requests, args.warmup, counter)
+    wait_for_background_work(args.background_timeout)
+    report['upstreams'] = {name: upstream.stats() for name, upstream in upstreams.items()}
+
+    output = args.output or os.path.join(
+        BENCHMARK_DIR, 'results', f"{datetime.utcnow():%Y%m%dT%H%M%SZ}-{report['revision'] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps(report['endpoints'], indent=2))
+    print(f'Report written to {output}')
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    for upstream in upstreams.values():
+        upstream.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+import heapq
+import itertools
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+# The Google client libraries and tzlocal are slow to import, so they are
+# imported by the functions that use them and load with the first reminder
+# rather than when a worker boots
+
+from instrumentation import timed
+from models import db, CalendarCredentials
+
+
+SCOPES = ['https://www.googleapis.com/auth/calendar',
+          'https://www.googleapis.com/auth/calendar.events']
+CLIENT_SECRETS_FILE = 'credentials.json'
+# Shared token file written by older versions, imported for one user and removed
+LEGACY_TOKEN_FILE = 'token.json'
+# Most calls the Calendar API accepts in one batch request
+CALENDAR_BATCH_LIMIT = 50
+# Tokens are refreshed in the background this long before they expire
+REFRESH_AHEAD = timedelta(seconds=int(os.environ.get('CALENDAR_REFRESH_AHEAD_SECONDS', 300)))
+# Sends Calendar requests to another server, such as the benchmark stand-in
+CALENDAR_ROOT_URL = os.environ.get('CALENDAR_ROOT_URL')
+
+_app = None
+_discovery_document = None
+_services = {}
+_lock = threading.Lock()
+# One thread per process refreshes every user's token from a heap of
+# (due, sequence, user id, credentials). _refresh_due holds each user's
+# current sequence number; entries replaced or forgotten since are skipped.
+_refresh_queue = []
+_refresh_due = {}
+_refresh_sequence = itertools.count()
+_refresh_ready = threading.Condition(_lock)
+_refresher = None
+
+
+class CalendarRequestFailed(Exception):
+    # A Calendar API call was rejected; status is the HTTP status code
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def init_calendar(app):
+    global _app
+    _app = app
+
+
+def _calendar_document():
+    # The Calendar discovery document ships with googleapiclient, so it is
+    # read and parsed once instead of fetched on every build()
+    global _discovery_document
+    if _discovery_document is None:
+        from googleapiclient.discovery_cache import get_static_doc
+        document = json.loads(get_static_doc('calendar', 'v3'))
+        if CALENDAR_ROOT_URL:
+            document['rootUrl'] = CALENDAR_ROOT_URL
+            document['baseUrl'] = CALENDAR_ROOT_URL + document['servicePath']
+        _discovery_document = document
+    return _discovery_document
+
+
+def _build_request(http, *args, **kwargs):
+    # httplib2 isn't thread safe, so each request made through a shared
+    # service object gets its own Http
+    import google_auth_httplib2
+    import httplib2
+    from googleapiclient.http import HttpRequest
+    authorized_http = google_auth_httplib2.AuthorizedHttp(http.credentials, http=httplib2.Http())
+    return HttpRequest(authorized_http, *args, **kwargs)
+
+
+def save_credentials(user_id, creds):
+    row = db.session.get(CalendarCredentials, user_id) or CalendarCredentials(user_id=user_id)
+    row.token = creds.to_json()
+    row.expiry = creds.expiry
+    row.updated_at = datetime.utcnow()
+    db.session.add(row)
+    db.session.commit()
+
+
+def _load_credentials(user_id):
+    # Returns (credentials, whether they still need saving for this user)
+    from google.oauth2.credentials import Credentials
+    row = db.session.get(CalendarCredentials, user_id)
+    if row:
+        return Credentials.from_authorized_user_info(json.loads(row.token), SCOPES), False
+    legacy = _claim_legacy_token()
+    if legacy:
+        print(f"Imported {LEGACY_TOKEN_FILE} for User:{user_id}")
+        return Credentials.from_authorized_user_info(legacy, SCOPES), True
+    return None, True
+
+
+def _claim_legacy_token():
+    # The shared token belongs to whoever set the app up, so it is handed to
+    # the first user who needs credentials and then removed; everyone else
+    # goes through OAuth. The rename lets only one thread or worker claim it.
+    claimed = f'{LEGACY_TOKEN_FILE}.{os.getpid()}.{threading.get_ident()}'
+    try:
+        os.rename(LEGACY_TOKEN_FILE, claimed)
+    except OSError:
+        return None
+    try:
+        with open(claimed) as f:
+            return json.load(f)
+    finally:
+        os.remove(claimed)
+
+
+@timed('calendar.get_credentials')
+def get_credentials(user_id):
+    from google.auth.transport.requests import Request
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    creds, unsaved = _load_credentials(user_id)
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRETS_FILE, SCOPES)
+            # Specify a fixed port here
+            creds = flow.run_local_server(port=8080)
+        unsaved = True
+    if unsaved:
+        save_credentials(user_id, creds)
+    return creds
+
+
+def get_calendar_service(user_id):
+    with _lock:
+        cached = _services.get(user_id)
+    if cached and cached[1].valid:
+        return cached[0]
+    from googleapiclient.discovery import build_from_document
+    creds = get_credentials(user_id)
+    service = build_from_document(_calendar_document(), credentials=creds, requestBuilder=_build_request)
+    with _lock:
+        _services[user_id] = (service, creds)
+    _schedule_refresh(user_id, creds)
+    return service
+
+
+def forget_calendar_service(user_id):
+    with _lock:
+        _services.pop(user_id, None)
+        _refresh_due.pop(user_id, None)
+    CalendarCredentials.query.filter_by(user_id=user_id).delete()
+    db.session.commit()
+
+
+def _schedule_refresh(user_id, creds):
+    if not creds.expiry or not creds.refresh_token or _app is None:
+        return
+    global _refresher
+    with _refresh_ready:
+        sequence = next(_refresh_sequence)
+        _refresh_due[user_id] = sequence
+        heapq.heappush(_refresh_queue, (creds.expiry - REFRESH_AHEAD, sequence, user_id, creds))
+        # Threads don't survive a fork, so a worker starts its own
+        if _refresher is None or not _refresher.is_alive():
+            _refresher = threading.Thread(target=_refresh_loop, name='calendar-refresh', daemon=True)
+            _refresher.start()
+        _refresh_ready.notify()
+
+
+def _next_refresh():
+    # Blocks until the earliest live entry is due and returns it
+    with _refresh_ready:
+        while True:
+            while _refresh_queue and _refresh_due.get(_refresh_queue[0][2]) != _refresh_queue[0][1]:
+                heapq.heappop(_refresh_queue)
+            if not _refresh_queue:
+                _refresh_ready.wait()
+                continue
+            wait = (_refresh_queue[0][0] - datetime.utcnow()).total_seconds()
+            if wait <= 0:
+                _, _, user_id, creds = heapq.heappop(_refresh_queue)
+                del _refresh_due[user_id]
+                return user_id, creds
+            _refresh_ready.wait(wait)
+
+
+def _refresh_loop():
+    while True:
+        _refresh_in_background(*_next_refresh())
+
+
+def _refresh_in_background(user_id, creds):
+    # Refreshes the credentials object held by the cached service in place,
+    # so requests never have to wait for a token refresh
+    from google.auth.transport.requests import Request
+    with _app.app_context():
+        try:
+            creds.refresh(Request())
+            save_credentials(user_id, creds)
+        except Exception as e:
+            # Any failure must not stop the refresher thread; the next
+            # request for this user builds the service again
+            print(f"Unable to refresh calendar credentials for User:{user_id}: {e}")
+            with _lock:
+                _services.pop(user_id, None)
+            return
+    _schedule_refresh(user_id, creds)
+
+
+def reminder_event(movie_dict, time_zone=None):
+    # Builds a Calendar event from a movie card; releaseDate is the card's
+    # "Release Date: YYYY-MM-DD" text. Raises ValueError for bad dates.
+    from tzlocal import get_localzone
+    time_zone = str(time_zone or get_localzone())
+    release_date_str = movie_dict['releaseDate'].split(': ')[-1]
+    start_datetime = datetime.fromisoformat(release_date_str + "T12:00:00")
+    end_datetime = datetime.fromisoformat(release_date_str + "T14:00:00")
+    return {
+        "summary": movie_dict['title'],
+        "description": movie_dict['genre'] + movie_dict['rating'],
+        "start": {
+            "dateTime": start_datetime.isoformat(),
+            "timeZone": time_zone
+        },
+        "end": {
+            "dateTime": end_datetime.isoformat(),
+            "timeZone": time_zone
+        },
+        "reminders": {
+            "useDefault": True
+        }
+    }
+
+
+@timed('calendar.insert_reminders')
+def insert_reminders(user_id, events):
+    # Inserts the events with batch HTTP requests of up to
+    # CALENDAR_BATCH_LIMIT events each. Returns the titles that were added and
+    # the ones that failed. Raises CalendarRequestFailed when the batch
+    # request itself is rejected.
+    from googleapiclient.errors import HttpError
+    service = get_calendar_service(user_id)
+    added, failed = [], []
+
+    def inserted(request_id, response, exception):
+        title = events[int(request_id)]['summary']
+        if exception is None:
+            added.append(title)
+        else:
+            print(f"Unable to add reminder for {title}: {exception}")
+            failed.append(title)
+
+    for start in range(0, len(events), CALENDAR_BATCH_LIMIT):
+        batch = service.new_batch_http_request(callback=inserted)
+        for i in range(start, min(start + CALENDAR_BATCH_LIMIT, len(events))):
+            batch.add(service.events().insert(calendarId='primary', body=events[i]), request_id=str(i))
+        try:
+            batch.execute()
+        except HttpError as e:
+            raise CalendarRequestFailed(e.resp.status, str(e)) from e
+    return added, failed
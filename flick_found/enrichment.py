@@ -0,0 +1,246 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_
+from sqlalchemy.exc import SQLAlchemyError
+
+import metrics
+from genres import genre_mask_from_ids
+from instrumentation import span
+from models import db, RecommendedMovies
+from page_cache import recommendations_changed
+from rate_limiter import BACKGROUND, lane
+from tmdb import LOOKUP_FAILED, search_movies
+
+
+# Saved recommendations are matched to TMDB in batches of this many titles
+ENRICH_BATCH_SIZE = int(os.environ.get('ENRICH_BATCH_SIZE', 10))
+# Batches enriched at once. The searches within a batch run one by one in
+# the background rate limit lane.
+ENRICH_WORKERS = int(os.environ.get('ENRICH_WORKERS', 2))
+# Titles whose TMDB lookup failed are tried again after a random delay of up
+# to ENRICH_RETRY_SECONDS * 2 ** n on retry n, at most ENRICH_RETRIES times;
+# after that they wait for their claim to run out
+ENRICH_RETRY_SECONDS = float(os.environ.get('ENRICH_RETRY_SECONDS', 30))
+ENRICH_RETRY_MAX_SECONDS = float(os.environ.get('ENRICH_RETRY_MAX_SECONDS', 30 * 60))
+ENRICH_RETRIES = int(os.environ.get('ENRICH_RETRIES', 5))
+# Rows are claimed when they are queued, so only one worker enriches each.
+# A claim older than this is taken to belong to a process that stopped, or
+# to a row whose retries all failed, and the row can be claimed again.
+ENRICH_CLAIM_TIMEOUT = timedelta(seconds=int(os.environ.get('ENRICH_CLAIM_SECONDS', 2 * 3600)))
+# Each worker looks this often for unclaimed rows, and claims at most a page
+# of them, and only while its own pool is idle
+ENRICH_RESUME_SECONDS = int(os.environ.get('ENRICH_RESUME_SECONDS', 60))
+ENRICH_RESUME_PAGE = int(os.environ.get('ENRICH_RESUME_PAGE', 100))
+
+_executor = ThreadPoolExecutor(max_workers=ENRICH_WORKERS, thread_name_prefix='enrichment')
+_app = None
+_last_resume = None
+_resume_lock = threading.Lock()
+# Heap of (due, sequence, user id, title keys, retry number)
+_retries = []
+_retry_sequence = itertools.count()
+_retry_lock = threading.Lock()
+# Batches queued or running on the executor
+_batches = 0
+_batches_lock = threading.Lock()
+
+
+def init_enrichment(app):
+    global _app
+    _app = app
+    # Like jobs, rows left unenriched by a process that stopped are picked
+    # up from requests, on a worker's first and then every
+    # ENRICH_RESUME_SECONDS
+    app.before_request(_resume_if_due)
+    app.before_request(_queue_due_retries)
+
+
+def _resume_if_due():
+    global _last_resume
+    now = time.monotonic()
+    if _last_resume is not None and now - _last_resume < ENRICH_RESUME_SECONDS:
+        return
+    with _resume_lock:
+        if _last_resume is not None and now - _last_resume < ENRICH_RESUME_SECONDS:
+            return
+        _last_resume = now
+    # A backlog is worked through a page at a time, and never ahead of
+    # recommendations this worker just saved
+    if not queued_batches():
+        resume_pending()
+
+
+def enqueue(user_id, title_keys, retry=0):
+    # Queues a user's saved recommendations for enrichment and returns
+    # straight away. Rows that are already enriched are skipped.
+    if _app is None:
+        return
+    title_keys = list(title_keys)
+    for start in range(0, len(title_keys), ENRICH_BATCH_SIZE):
+        _count_batches(1)
+        future = _executor.submit(_run_batch, user_id, title_keys[start:start + ENRICH_BATCH_SIZE], retry)
+        future.add_done_callback(lambda _: _count_batches(-1))
+
+
+def _count_batches(change):
+    global _batches
+    with _batches_lock:
+        _batches += change
+
+
+def queued_batches():
+    # Batches queued or running; retries still waiting out their backoff
+    # aren't counted
+    with _batches_lock:
+        return _batches
+
+
+def _retry_later(user_id, title_keys, retry):
+    if retry > ENRICH_RETRIES:
+        metrics.increment('enrichment_retries_total', len(title_keys), result='gave_up')
+        return
+    delay = random.uniform(0, min(ENRICH_RETRY_MAX_SECONDS, ENRICH_RETRY_SECONDS * 2 ** retry))
+    with _retry_lock:
+        heapq.heappush(_retries, (time.monotonic() + delay, next(_retry_sequence), user_id, title_keys, retry))
+    metrics.increment('enrichment_retries_total', len(title_keys), result='queued')
+
+
+def _queue_due_retries():
+    # Checked before each request and after each batch, so no thread sits
+    # waiting for the next retry
+    due = []
+    now = time.monotonic()
+    with _retry_lock:
+        while _retries and _retries[0][0] <= now:
+            due.append(heapq.heappop(_retries))
+    for _, _, user_id, title_keys, retry in due:
+        enqueue(user_id, title_keys, retry)
+
+
+def resume_pending():
+    # Claims up to ENRICH_RESUME_PAGE unclaimed rows, oldest first, and
+    # queues them. Returns how many were claimed.
+    now = datetime.utcnow()
+    candidates = db.session.query(RecommendedMovies.id, RecommendedMovies.user_id, RecommendedMovies.title_key) \
+        .filter(*_claimable(now)) \
+        .order_by(RecommendedMovies.id) \
+        .limit(ENRICH_RESUME_PAGE) \
+        .all()
+    title_keys_by_user = {}
+    claimed = 0
+    for row_id, user_id, title_key in candidates:
+        # Conditional update, so a row seen by several workers is claimed once
+        if RecommendedMovies.query \
+                .filter(RecommendedMovies.id == row_id, *_claimable(now)) \
+                .update({'enrichment_claimed_at': now}, synchronize_session=False):
+            title_keys_by_user.setdefault(user_id, []).append(title_key)
+            claimed += 1
+    db.session.commit()
+    for user_id, title_keys in title_keys_by_user.items():
+        enqueue(user_id, title_keys)
+    if claimed:
+        print(f'Resumed enrichment of {claimed} recommendations')
+    return claimed
+
+
+def _claimable(now):
+    # Unenriched rows nobody holds a live claim on
+    return (RecommendedMovies.enriched_at.is_(None),
+            or_(RecommendedMovies.enrichment_claimed_at.is_(None),
+                RecommendedMovies.enrichment_claimed_at < now - ENRICH_CLAIM_TIMEOUT))
+
+
+def _run_batch(user_id, title_keys, retry=0):
+    with _app.app_context(), lane(BACKGROUND):
+        try:
+            with span('enrichment.batch'):
+                enriched, failed = enrich(user_id, title_keys)
+        except Exception as e:
+            db.session.rollback()
+            print(f'Enriching recommendations for user {user_id} failed: {e}')
+            enriched, failed = 0, title_keys
+        if enriched:
+            # The user's cards now link straight to their posters
+            recommendations_changed(user_id)
+    if failed:
+        _retry_later(user_id, failed, retry + 1)
+    _queue_due_retries()
+
+
+def _apply_match(row, movie):
+    row.tmdb_id = movie['id']
+    row.poster_path = movie.get('poster_path')
+    if movie.get('vote_count'):
+        row.rating = round(movie['vote_average'], 1)
+    if movie.get('release_date'):
+        row.release_date = movie['release_date']
+    row.genre_ids = movie.get('genre_ids') or []
+    row.genre_mask = genre_mask_from_ids(row.genre_ids) or row.genre_mask
+
+
+def _copy_match(row, source):
+    row.tmdb_id = source.tmdb_id
+    row.poster_path = source.poster_path
+    row.rating = source.rating
+    row.release_date = source.release_date
+    row.genre_ids = source.genre_ids
+    row.genre_mask = source.genre_mask
+
+
+def enrich(user_id, title_keys):
+    # Fills in the TMDB id, poster, rating, release date and genres of the
+    # user's unenriched rows with these title keys. Returns how many rows
+    # were enriched and the title keys TMDB couldn't be asked about, which
+    # stay unenriched.
+    rows = RecommendedMovies.query \
+        .filter(RecommendedMovies.user_id == user_id,
+                RecommendedMovies.title_key.in_(title_keys),
+                RecommendedMovies.enriched_at.is_(None)) \
+        .all()
+    if not rows:
+        return 0, []
+
+    # A title already matched for another user is copied, not searched again
+    latest_matches = db.session.query(func.max(RecommendedMovies.id)) \
+        .filter(RecommendedMovies.title_key.in_([row.title_key for row in rows]),
+                RecommendedMovies.tmdb_id.isnot(None),
+                RecommendedMovies.enriched_at.isnot(None)) \
+        .group_by(RecommendedMovies.title_key)
+    matches = {source.title_key: source
+               for source in RecommendedMovies.query.filter(RecommendedMovies.id.in_(latest_matches)).all()}
+    to_search = [row for row in rows if row.title_key not in matches]
+    results = search_movies([row.title for row in to_search]) if to_search else []
+
+    now = datetime.utcnow()
+    enriched = 0
+    failed = []
+    for row in rows:
+        if row.title_key in matches:
+            _copy_match(row, matches[row.title_key])
+            row.enriched_at = now
+            enriched += 1
+    metrics.increment('enrichment_rows_total', enriched, result='copied')
+    for row, movie in zip(to_search, results):
+        if movie is LOOKUP_FAILED:
+            metrics.increment('enrichment_rows_total', result='failed')
+            failed.append(row.title_key)
+            continue
+        if movie:
+            _apply_match(row, movie)
+        row.enriched_at = now
+        enriched += 1
+        metrics.increment('enrichment_rows_total', result='matched' if movie else 'no_match')
+    try:
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(f'Unable to save enriched recommendations: {e}')
+        return 0, [row.title_key for row in rows]
+    return enriched, failed
@@ -0,0 +1,84 @@
+import re
+
+
+# TMDB genre id, canonical name and other spellings users and the LLM use.
+# A genre's bit in a genre mask is its position in this list, so only ever
+# append to it: stored masks depend on the order.
+GENRES = [
+    (28, "action", ("actions",)),
+    (12, "adventure", ()),
+    (16, "animation", ("animated", "anime", "cartoon")),
+    (35, "comedy", ("comedies", "funny")),
+    (80, "crime", ("gangster", "heist")),
+    (99, "documentary", ("documentaries", "doc", "docs")),
+    (18, "drama", ("dramas",)),
+    (10751, "family", ("kids", "children")),
+    (14, "fantasy", ()),
+    (36, "history", ("historical", "period")),
+    (27, "horror", ("scary", "slasher")),
+    (10402, "music", ("musical", "musicals")),
+    (9648, "mystery", ("whodunit",)),
+    (10749, "romance", ("romantic",)),
+    (878, "scifi", ("science fiction", "sf", "sci fi")),
+    (10770, "tv movie", ("tv",)),
+    (53, "thriller", ("thrillers", "suspense", "psychological thriller")),
+    (10752, "war", ()),
+    (37, "western", ("westerns",)),
+]
+
+# Spellings that stand for more than one genre
+COMBINED_GENRES = {
+    "romcom": ("romance", "comedy"),
+    "romantic comedy": ("romance", "comedy"),
+    "action adventure": ("action", "adventure"),
+    "action comedy": ("action", "comedy"),
+    "sci fi fantasy": ("scifi", "fantasy"),
+}
+
+
+def normalize_genre_name(name):
+    return re.sub(r'\W+', '', name.lower())
+
+
+GENRE_NAMES_BY_ID = {genre_id: name for genre_id, name, aliases in GENRES}
+GENRE_BITS_BY_ID = {genre_id: 1 << bit for bit, (genre_id, name, aliases) in enumerate(GENRES)}
+GENRE_MASKS_BY_NAME = {}
+for genre_id, name, aliases in GENRES:
+    for spelling in (name, *aliases):
+        GENRE_MASKS_BY_NAME[normalize_genre_name(spelling)] = GENRE_BITS_BY_ID[genre_id]
+for spelling, names in COMBINED_GENRES.items():
+    GENRE_MASKS_BY_NAME[normalize_genre_name(spelling)] = sum(
+        GENRE_MASKS_BY_NAME[normalize_genre_name(name)] for name in names)
+ALL_GENRES_MASK = (1 << len(GENRES)) - 1
+
+
+def convert_id_to_genre_name(genre_id):
+    return GENRE_NAMES_BY_ID.get(genre_id, "Unknown")
+
+
+def genre_mask(genre_text):
+    # Mask of every known genre in free text such as "Action, Sci-Fi",
+    # "Romantic Comedy" or "Crime Drama"; 0 when nothing is recognized
+    text = str(genre_text or '')
+    mask = GENRE_MASKS_BY_NAME.get(normalize_genre_name(text), 0)
+    for part in re.split(r'[,/&|;]+|\band\b', text):
+        mask |= GENRE_MASKS_BY_NAME.get(normalize_genre_name(part), 0)
+        # Genres run together ("Crime Drama", "Comedy-Drama"): try each word
+        # and each pair of words, for names like "sci-fi" or "science fiction"
+        words = [word for word in re.split(r'[\s-]+', part) if word]
+        for i, word in enumerate(words):
+            mask |= GENRE_MASKS_BY_NAME.get(normalize_genre_name(word), 0)
+            if i + 1 < len(words):
+                mask |= GENRE_MASKS_BY_NAME.get(normalize_genre_name(word + words[i + 1]), 0)
+    return mask
+
+
+def genre_mask_from_ids(genre_ids):
+    mask = 0
+    for genre_id in genre_ids:
+        mask |= GENRE_BITS_BY_ID.get(genre_id, 0)
+    return mask
+
+
+def genre_names(mask):
+    return [name for bit, (genre_id, name, aliases) in enumerate(GENRES) if mask >> bit & 1]
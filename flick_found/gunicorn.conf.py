@@ -0,0 +1,37 @@
+import multiprocessing
+import os
+
+
+# Loaded automatically by `gunicorn wsgi:app` when run from flick_found/.
+# Every setting can be overridden from the environment.
+
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', 8000)}")
+# Worker processes; each one serves requests on a pool of threads, so the
+# app uses every core while blocking calls to TMDB and the database overlap
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+# Recommendations are generated in background jobs, so no request should
+# come close to this
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+# Restart workers now and then so a slow leak can't grow unbounded
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+# The app is built in each worker after the fork: job threads and database
+# connections made in the master would not survive it
+preload_app = False
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    # Workers share their metrics through files; a new server starts from zero
+    import metrics
+    metrics.clear_shared()
+    # Upgrade the schema once in the master, before any worker serves a request
+    if os.getenv('DB_AUTO_UPGRADE', '1') == '1':
+        from app import create_app, upgrade_database
+        upgrade_database(create_app())
@@ -0,0 +1,79 @@
+import json
+import os
+import re
+import subprocess
+import sys
+
+import click
+
+
+# Cold-start budget for importing the WSGI entry point, in milliseconds
+IMPORT_BUDGET_MS = float(os.environ.get('IMPORT_BUDGET_MS', 1500))
+# Integrations that load on first use and must never be imported at boot
+DEFERRED_MODULES = ('openai', 'googleapiclient', 'google_auth_oauthlib', 'google_auth_httplib2', 'google.oauth2',
+                    'httplib2', 'tzlocal', 'requests', 'pydantic')
+APP_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+_IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def profile_imports(module):
+    # Imports module in a fresh interpreter under -X importtime. Returns the
+    # modules it loaded as dicts of name, self_ms and cumulative_ms, with the
+    # module itself last.
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=APP_DIRECTORY, capture_output=True, text=True)
+    entries = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        if not indent:
+            # A top level import: either the module, or part of interpreter startup
+            if name != module:
+                entries = []
+                continue
+        entries.append({'name': name, 'self_ms': int(self_us) / 1000, 'cumulative_ms': int(cumulative_us) / 1000})
+    if result.returncode or not entries or entries[-1]['name'] != module:
+        raise click.ClickException(f'Importing {module} failed:\n{result.stderr[-2000:]}')
+    return entries
+
+
+def deferred_imports(entries):
+    return sorted({entry['name'] for entry in entries
+                   if any(entry['name'] == name or entry['name'].startswith(name + '.') for name in DEFERRED_MODULES)})
+
+
+@click.command('importtime')
+@click.option('--module', default='wsgi', show_default=True, help='Module a worker imports on boot.')
+@click.option('--budget', type=float, default=IMPORT_BUDGET_MS, show_default=True,
+              help='Fail when importing the module takes longer, in milliseconds.')
+@click.option('--repeat', default=3, show_default=True, help='Import this many times and keep the fastest.')
+@click.option('--top', default=15, show_default=True, help='Slowest imports to list.')
+@click.option('--json', 'as_json', is_flag=True, help='Print the report as JSON.')
+def importtime_command(module, budget, repeat, top, as_json):
+    """Profile the cold-start import time of the app against a budget."""
+    entries = min((profile_imports(module) for _ in range(max(repeat, 1))), key=lambda e: e[-1]['cumulative_ms'])
+    total = entries[-1]['cumulative_ms']
+    deferred = deferred_imports(entries)
+    slowest = sorted(entries[:-1], key=lambda entry: entry['self_ms'], reverse=True)[:top]
+    report = {'module': module, 'total_ms': total, 'budget_ms': budget, 'modules': len(entries),
+              'deferred_modules_loaded': deferred, 'slowest': slowest}
+
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+    else:
+        click.echo(f'import {module}: {total:.1f} ms for {len(entries)} modules (budget {budget:.0f} ms)')
+        click.echo(f"{'self ms':>10} {'cumulative ms':>14}  module")
+        for entry in slowest:
+            click.echo(f"{entry['self_ms']:>10.1f} {entry['cumulative_ms']:>14.1f}  {entry['name']}")
+        if deferred:
+            click.echo(f"Loaded at import but meant to load on first use: {', '.join(deferred)}")
+
+    if total > budget or deferred:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    importtime_command()
@@ -0,0 +1,127 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Response, abort, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import metrics
+
+
+# Requests slower than this many seconds are logged with a breakdown of
+# where the time went; unset or 0 turns the log off
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 0))
+# When set, /metrics requires "Authorization: Bearer <token>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+slow_request_log = logging.getLogger('flick_found.slow_requests')
+
+# Time spent in each span and in the database by the request the current
+# thread is serving. Work handed to other threads is timed but not added to
+# the request's breakdown.
+_current = threading.local()
+
+
+def _request_totals():
+    return getattr(_current, 'totals', None)
+
+
+@contextmanager
+def span(name):
+    # Times the block into the span_seconds histogram, labelled with the span
+    # name and whether it raised
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    except GeneratorExit:
+        # A generator closed early by its consumer finished normally
+        outcome = 'ok'
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe('span_seconds', elapsed, span=name, outcome=outcome)
+        totals = _request_totals()
+        if totals is not None:
+            totals[name] = totals.get(name, 0) + elapsed
+
+
+def timed(name):
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'UNKNOWN'
+    metrics.observe('db_query_seconds', elapsed, operation=operation)
+    totals = _request_totals()
+    if totals is not None:
+        totals['db'] = totals.get('db', 0) + elapsed
+        totals['db_queries'] = totals.get('db_queries', 0) + 1
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute; drop its start
+    # time so the next query on the connection isn't timed from it
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('query_start'):
+        conn.info['query_start'].pop()
+        metrics.increment('db_query_errors_total')
+
+
+def _start_request():
+    g.request_start = time.perf_counter()
+    _current.totals = {}
+
+
+def _finish_request(response):
+    if 'request_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unmatched'
+    totals = _request_totals() or {}
+    metrics.observe('http_request_seconds', elapsed, endpoint=endpoint, method=request.method)
+    metrics.increment('http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+    metrics.increment('db_queries_total', totals.get('db_queries', 0), endpoint=endpoint)
+    if SLOW_REQUEST_SECONDS and elapsed >= SLOW_REQUEST_SECONDS:
+        breakdown = ', '.join(f'{name}={value:.3f}s' for name, value in sorted(totals.items())
+                              if name != 'db_queries')
+        slow_request_log.warning('%s %s %s took %.3fs (%d queries; %s)', request.method, request.path,
+                                 response.status_code, elapsed, totals.get('db_queries', 0), breakdown or 'no spans')
+    return response
+
+
+def _clear_request(exception=None):
+    _current.totals = None
+
+
+def metrics_endpoint():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        abort(401)
+    # Whichever worker answers adds up the metrics of every worker
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+def init_instrumentation(app):
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_clear_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_
+
+import metrics
+from models import db, normalize_title, RecommendationJob
+from recommendation_cache import get_cached_recommendations, store_recommendations
+from recommender import (RECOMMENDATION_COUNT, process_choices_and_recommendations,
+                         generate_recommendations_streaming, modify_database)
+
+
+JOB_WORKERS = int(os.environ.get('RECOMMENDATION_WORKERS', 4))
+# Save recommendations as they stream in instead of after the whole reply
+STREAM_RECOMMENDATIONS = os.environ.get('STREAM_RECOMMENDATIONS', '1') == '1'
+# A running job that hasn't been touched for this long belonged to a worker
+# that stopped, and can be picked up again. Well over LLM_DEADLINE, the
+# longest a job goes without saving anything.
+JOB_STALE_AFTER = timedelta(seconds=int(os.environ.get('RECOMMENDATION_JOB_STALE_SECONDS', 300)))
+# How often each worker looks for pending and stale jobs to pick up
+JOB_SWEEP_SECONDS = int(os.environ.get('RECOMMENDATION_JOB_SWEEP_SECONDS', 60))
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='recommendations')
+_app = None
+_last_sweep = None
+_sweep_lock = threading.Lock()
+# Jobs queued on this process's executor, which sweeps leave alone
+_queued = set()
+_queued_lock = threading.Lock()
+
+
+def init_jobs(app):
+    global _app
+    _app = app
+    # Sweeps run from requests rather than when the app is built, so the
+    # flask CLI and gunicorn's master process never pick jobs up. A worker
+    # sweeps on its first request, which resumes jobs left by the worker it
+    # replaced, and again every JOB_SWEEP_SECONDS, which picks up jobs that
+    # only went stale later.
+    app.before_request(_sweep_if_due)
+
+
+def _sweep_if_due():
+    global _last_sweep
+    now = time.monotonic()
+    if _last_sweep is not None and now - _last_sweep < JOB_SWEEP_SECONDS:
+        return
+    with _sweep_lock:
+        if _last_sweep is not None and now - _last_sweep < JOB_SWEEP_SECONDS:
+            return
+        _last_sweep = now
+    resume_unfinished_jobs()
+
+
+def _queue(job_id):
+    with _queued_lock:
+        if job_id in _queued:
+            return False
+        _queued.add(job_id)
+    future = _executor.submit(_run_job, job_id)
+    future.add_done_callback(lambda _: _forget(job_id))
+    return True
+
+
+def _forget(job_id):
+    with _queued_lock:
+        _queued.discard(job_id)
+
+
+def queued_jobs():
+    # Jobs queued or running on this process's executor
+    with _queued_lock:
+        return len(_queued)
+
+
+def submit_job(user_id, movie_choices, genres, requested=RECOMMENDATION_COUNT, local_recommendations=()):
+    job = RecommendationJob(user_id=user_id, movie_choices=movie_choices, genres=genres, requested=requested,
+                            local_recommendations=list(local_recommendations))
+    db.session.add(job)
+    db.session.commit()
+    _queue(job.id)
+    return job
+
+
+def resume_unfinished_jobs():
+    stale_before = datetime.utcnow() - JOB_STALE_AFTER
+    unfinished = db.session.query(RecommendationJob.id).filter(_claimable(stale_before)).all()
+    resumed = sum(_queue(job_id) for (job_id,) in unfinished)
+    if resumed:
+        print(f'Resumed {resumed} unfinished recommendation jobs')
+
+
+def _claimable(stale_before):
+    return or_(RecommendationJob.status == 'pending',
+               and_(RecommendationJob.status == 'running', RecommendationJob.updated_at < stale_before))
+
+
+def _claim(job_id):
+    # Conditional update, so a job queued by several workers only runs once
+    now = datetime.utcnow()
+    claimed = RecommendationJob.query \
+        .filter(RecommendationJob.id == job_id, _claimable(now - JOB_STALE_AFTER)) \
+        .update({'status': 'running', 'updated_at': now}, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+
+def _finish(job, status, error=None):
+    job.status = status
+    job.error = error[:255] if error else None
+    job.updated_at = datetime.utcnow()
+    db.session.commit()
+
+
+def _run_job(job_id):
+    with _app.app_context():
+        if not _claim(job_id):
+            return
+        job = db.session.get(RecommendationJob, job_id)
+        start = time.monotonic()
+        mode = 'cached'
+        try:
+            # An identical job may have filled the cache since this one was queued
+            cached = get_cached_recommendations(job.movie_choices, job.genres)
+            if cached:
+                local_keys = {normalize_title(rec['title']) for rec in job.local_recommendations or []}
+                cached = [rec for rec in cached if normalize_title(rec['title']) not in local_keys]
+                job.saved = modify_database(cached[:job.requested], job.user_id)
+                _finish(job, 'done')
+            elif STREAM_RECOMMENDATIONS:
+                mode = 'streaming'
+                _run_streaming(job)
+            else:
+                mode = 'blocking'
+                _run_blocking(job)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Recommendation job {job_id} failed: {e}")
+            _finish(job, 'failed', str(e))
+        # Wall time from claiming the job to its last recommendation saved
+        metrics.observe('recommendation_job_seconds', time.monotonic() - start, mode=mode, status=job.status)
+
+
+def _run_blocking(job):
+    recommendations = process_choices_and_recommendations(job.movie_choices, job.genres, job.requested)
+    if recommendations:
+        job.saved = modify_database(recommendations, job.user_id)
+        _store_complete_set(job, recommendations)
+        _finish(job, 'done')
+    else:
+        _finish(job, 'failed', 'Unable to process API Request and Convert to DB')
+
+
+def _run_streaming(job):
+    generated = []
+
+    def save_batch(batch):
+        # Progress for the results page, which reloads as rows arrive
+        job.saved += modify_database(batch, job.user_id)
+        generated.extend(batch)
+        job.updated_at = datetime.utcnow()
+        db.session.commit()
+
+    if generate_recommendations_streaming(job.movie_choices, job.genres, save_batch, job.requested):
+        _store_complete_set(job, generated)
+        _finish(job, 'done')
+    else:
+        _finish(job, 'failed', 'Unable to process API Request and Convert to DB')
+
+
+def _store_complete_set(job, generated):
+    # Only complete sets are worth serving to the next user: everything the
+    # job asked for, together with the similar movies saved before it ran
+    recommendations = (job.local_recommendations or []) + generated
+    if len(generated) >= job.requested and len(recommendations) >= RECOMMENDATION_COUNT:
+        store_recommendations(job.movie_choices, job.genres, recommendations)
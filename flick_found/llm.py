@@ -0,0 +1,179 @@
+import os
+import random
+import threading
+import time
+
+import metrics
+from rate_limiter import RateLimited, acquire, throttle
+
+
+OPENAI_API_KEY = os.environ.get('OPENAI_KEY')
+
+LLM_MAX_ATTEMPTS = int(os.environ.get('LLM_MAX_ATTEMPTS', 4))
+# Backoff before retry n is a random delay between 0 and
+# min(LLM_MAX_DELAY, LLM_BASE_DELAY * 2 ** n) seconds
+LLM_BASE_DELAY = float(os.environ.get('LLM_BASE_DELAY', 0.5))
+LLM_MAX_DELAY = float(os.environ.get('LLM_MAX_DELAY', 8))
+# Total time budget for one call, including every retry and backoff
+LLM_DEADLINE = float(os.environ.get('LLM_DEADLINE', 90))
+LLM_REQUEST_TIMEOUT = float(os.environ.get('LLM_REQUEST_TIMEOUT', 45))
+# Consecutive upstream failures before calls fail fast, and how long they do
+LLM_BREAKER_THRESHOLD = int(os.environ.get('LLM_BREAKER_THRESHOLD', 5))
+LLM_BREAKER_RESET_SECONDS = float(os.environ.get('LLM_BREAKER_RESET_SECONDS', 30))
+
+
+def upstream_errors():
+    # Errors that mean the upstream is struggling, rather than a bad request.
+    # The openai SDK is slow to import, so it loads with the first LLM call.
+    import openai
+    return openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError
+
+
+class LLMUnavailable(Exception):
+    pass
+
+
+class InvalidResponse(Exception):
+    # Raised by an operation when the model answered but the answer is
+    # unusable. It is retried, but doesn't count against the circuit breaker.
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_seconds:
+                # Let a single trial call through to see if the upstream recovered
+                self._set_state('half_open')
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._set_state('closed')
+
+    def release_trial(self):
+        # The call let through by allow() was never made, so a half-open
+        # breaker goes back to open and the next caller makes the trial
+        with self._lock:
+            # _opened_at is kept, so the breaker doesn't count as opening again
+            # and the next caller is let through straight away
+            if self.state == 'half_open':
+                self.state = 'open'
+                metrics.set_gauge('llm_circuit_open', 1)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state('open')
+
+    def _set_state(self, state):
+        if state != self.state:
+            print(f'LLM circuit breaker is now {state}')
+            if state == 'open':
+                metrics.increment('llm_circuit_opened_total')
+        self.state = state
+        metrics.set_gauge('llm_circuit_open', int(state == 'open'))
+
+
+breaker = CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_RESET_SECONDS)
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    # One client per process, so every call reuses its pooled connections.
+    # Retries are ours to make, so the SDK's own are turned off.
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+                _client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0, timeout=LLM_REQUEST_TIMEOUT)
+    return _client
+
+
+def _retry_after(error, default=LLM_BASE_DELAY):
+    try:
+        return float(error.response.headers.get('retry-after', default))
+    except (AttributeError, ValueError):
+        return default
+
+
+def backoff_delay(attempt):
+    return random.uniform(0, min(LLM_MAX_DELAY, LLM_BASE_DELAY * 2 ** attempt))
+
+
+def call_with_retry(operation):
+    # Calls operation(timeout) until it succeeds, retrying upstream errors and
+    # InvalidResponse with backoff. Raises LLMUnavailable once the attempts or
+    # the deadline run out, or straight away while the breaker is open.
+    deadline = time.monotonic() + LLM_DEADLINE
+    last_error = None
+    for attempt in range(LLM_MAX_ATTEMPTS):
+        if not breaker.allow():
+            metrics.increment('llm_attempts_total', outcome='circuit_open')
+            raise LLMUnavailable('OpenAI circuit breaker is open') from last_error
+
+        try:
+            # Every worker shares one OpenAI budget; wait for it as long as
+            # the deadline allows
+            acquire('openai', timeout=max(deadline - time.monotonic(), 0))
+        except RateLimited as e:
+            breaker.release_trial()
+            metrics.increment('llm_attempts_total', outcome='rate_limited')
+            raise LLMUnavailable('OpenAI rate limit budget exhausted') from e
+        except BaseException:
+            breaker.release_trial()
+            raise
+
+        start = time.monotonic()
+        timeout = min(LLM_REQUEST_TIMEOUT, deadline - start)
+        try:
+            result = operation(timeout)
+        except upstream_errors() as e:
+            outcome = 'upstream_error'
+            breaker.record_failure()
+            last_error = e
+            if getattr(e, 'status_code', None) == 429:
+                # Slow every worker down, not just this one
+                throttle('openai', _retry_after(e))
+        except InvalidResponse as e:
+            outcome = 'invalid_response'
+            breaker.record_success()
+            last_error = e
+        except Exception:
+            # Bad requests and local errors aren't retried, and say nothing
+            # about the upstream's health, but must not leave the breaker
+            # stuck half open
+            metrics.increment('llm_attempts_total', outcome='error')
+            breaker.record_success()
+            raise
+        else:
+            metrics.increment('llm_attempts_total', outcome='ok')
+            metrics.observe('llm_request_seconds', time.monotonic() - start, outcome='ok')
+            breaker.record_success()
+            return result
+        metrics.increment('llm_attempts_total', outcome=outcome)
+        metrics.observe('llm_request_seconds', time.monotonic() - start, outcome=outcome)
+        print(f'LLM attempt {attempt + 1} failed: {last_error}')
+
+        delay = backoff_delay(attempt)
+        if attempt + 1 == LLM_MAX_ATTEMPTS or time.monotonic() + delay >= deadline:
+            break
+        metrics.increment('llm_retries_total', reason=outcome)
+        time.sleep(delay)
+    raise LLMUnavailable(f'OpenAI request failed after {attempt + 1} attempts') from last_error
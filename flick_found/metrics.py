@@ -0,0 +1,238 @@
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+
+
+# Upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# gunicorn runs several worker processes behind one port, so each process
+# writes its metrics to its own file here every METRICS_FLUSH_SECONDS and
+# /metrics adds up every file, whichever worker answers. Counters and
+# histograms of processes that have exited are folded into one file so the
+# totals never go down; their gauges are dropped.
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metrics'))
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+EXITED_FILE = 'exited.json'
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+# Functions that update gauges from elsewhere right before a snapshot
+_collectors = []
+# Process the flush thread was started in; a forked worker starts its own
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def increment(name, value=1, **labels):
+    _start_flusher()
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    _start_flusher()
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    _start_flusher()
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {'buckets': [0] * len(DEFAULT_BUCKETS), 'sum': 0, 'count': 0}
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                histogram['buckets'][i] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+def register_collector(collector):
+    _collectors.append(collector)
+
+
+def snapshot():
+    # Copies of every metric, keyed by (name, ((label, value), ...))
+    for collector in _collectors:
+        try:
+            collector()
+        except Exception as e:
+            print(f'Metrics collector {collector.__name__} failed: {e}')
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'histograms': {key: {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']}
+                           for key, h in _histograms.items()},
+        }
+
+
+def _start_flusher():
+    global _flusher_pid
+    if _flusher_pid != os.getpid():
+        with _flusher_lock:
+            if _flusher_pid != os.getpid():
+                _flusher_pid = os.getpid()
+                threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+                # A worker restarted by max_requests writes what it counted since the last flush
+                atexit.register(_flush_quietly)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        _flush_quietly()
+
+
+def _flush_quietly():
+    try:
+        flush()
+    except OSError as e:
+        print(f'Unable to write metrics to {METRICS_DIR}: {e}')
+
+
+def _encode(data):
+    # JSON has no tuples, so keys are written as [name, [[label, value], ...]]
+    return {kind: [[name, [list(pair) for pair in labels], value] for (name, labels), value in values.items()]
+            for kind, values in data.items()}
+
+
+def _decode(encoded):
+    return {kind: {(name, tuple(tuple(pair) for pair in labels)): value for name, labels, value in values}
+            for kind, values in encoded.items()}
+
+
+def _empty():
+    return {'counters': {}, 'gauges': {}, 'histograms': {}}
+
+
+def _add(into, data, gauges=True):
+    for key, value in data['counters'].items():
+        into['counters'][key] = into['counters'].get(key, 0) + value
+    for key, histogram in data['histograms'].items():
+        total = into['histograms'].get(key)
+        if total is None:
+            into['histograms'][key] = {'buckets': list(histogram['buckets']), 'sum': histogram['sum'],
+                                       'count': histogram['count']}
+        else:
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], histogram['buckets'])]
+            total['sum'] += histogram['sum']
+            total['count'] += histogram['count']
+    if gauges:
+        # Gauges are per process; the highest is shown, so e.g. a circuit
+        # breaker open in any worker reads as open
+        for key, value in data['gauges'].items():
+            into['gauges'][key] = max(value, into['gauges'].get(key, value))
+
+
+def _write(path, data):
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(_encode(data), f)
+    os.replace(temporary, path)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return _decode(json.load(f))
+    except (OSError, ValueError) as e:
+        print(f'Unable to read metrics from {path}: {e}')
+        return _empty()
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def flush():
+    # Writes this process's metrics to its file in METRICS_DIR
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write(os.path.join(METRICS_DIR, f'{os.getpid()}.json'), snapshot())
+
+
+def clear_shared():
+    # Drops every process's file; gunicorn's master calls it on start, so a
+    # restarted server counts from zero
+    if os.path.isdir(METRICS_DIR):
+        for name in os.listdir(METRICS_DIR):
+            os.remove(os.path.join(METRICS_DIR, name))
+
+
+def collect_all():
+    # Every process's metrics added up
+    flush()
+    merged = _empty()
+    with open(os.path.join(METRICS_DIR, '.lock'), 'w') as lock:
+        # Only one process at a time folds exited processes' files
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        exited_path = os.path.join(METRICS_DIR, EXITED_FILE)
+        exited = _read(exited_path) if os.path.exists(exited_path) else _empty()
+        folded = False
+        for name in os.listdir(METRICS_DIR):
+            if not name.endswith('.json') or name == EXITED_FILE:
+                continue
+            path = os.path.join(METRICS_DIR, name)
+            data = _read(path)
+            if _is_alive(int(name[:-len('.json')])):
+                _add(merged, data)
+            else:
+                _add(exited, data, gauges=False)
+                os.remove(path)
+                folded = True
+        if folded:
+            _write(exited_path, exited)
+    _add(merged, exited, gauges=False)
+    return merged
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{label}="{value}"' for (label, _), value in zip(pairs, escaped)) + '}'
+
+
+def render_prometheus():
+    # Every metric of every process in the Prometheus text exposition format
+    data = collect_all()
+    lines = []
+    for kind, values in (('counter', data['counters']), ('gauge', data['gauges'])):
+        typed = set()
+        for (name, labels), value in sorted(values.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name}{_labels(labels)} {value}')
+    typed = set()
+    for (name, labels), histogram in sorted(data['histograms'].items()):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f'# TYPE {name} histogram')
+        # observe() already counts each value in every bucket it fits, so
+        # the counts are cumulative as Prometheus expects
+        for bound, count in zip(DEFAULT_BUCKETS, histogram['buckets']):
+            lines.append(f'{name}_bucket{_labels(labels, le=bound)} {count}')
+        lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {histogram["count"]}')
+        lines.append(f'{name}_sum{_labels(labels)} {histogram["sum"]}')
+        lines.append(f'{name}_count{_labels(labels)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
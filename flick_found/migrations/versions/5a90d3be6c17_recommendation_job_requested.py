@@ -0,0 +1,26 @@
+"""recommendation job requested count
+
+Revision ID: 5a90d3be6c17
+Revises: c41d7e9a2f58
+Create Date: 2026-10-17 11:41:52.281740
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a90d3be6c17'
+down_revision = 'c41d7e9a2f58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('recommendation_job') as batch_op:
+        batch_op.add_column(sa.Column('requested', sa.Integer(), nullable=False, server_default='30'))
+
+
+def downgrade():
+    with op.batch_alter_table('recommendation_job') as batch_op:
+        batch_op.drop_column('requested')
@@ -0,0 +1,109 @@
+"""caches, jobs and per-user indexes
+
+Revision ID: 8b2e41c7d5a3
+Revises: 3f6c2a1d9b10
+Create Date: 2026-10-17 09:48:05.117062
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e41c7d5a3'
+down_revision = '3f6c2a1d9b10'
+branch_labels = None
+depends_on = None
+
+
+def _normalize_title(title):
+    # Same as models.normalize_title at the time of this revision
+    return re.sub(r'\s+', ' ', title).strip().lower()[:120]
+
+
+def _delete_duplicates(table, columns, keep='MIN'):
+    op.execute(
+        f"DELETE FROM {table} WHERE id NOT IN "
+        f"(SELECT keep_id FROM (SELECT {keep}(id) AS keep_id FROM {table} GROUP BY {', '.join(columns)}) AS kept)"
+    )
+
+
+def upgrade():
+    op.create_table('poster_cache',
+    sa.Column('title_key', sa.String(length=120), nullable=False),
+    sa.Column('tmdb_id', sa.Integer(), nullable=True),
+    sa.Column('poster_path', sa.String(length=120), nullable=True),
+    sa.Column('fetched_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('title_key')
+    )
+    op.create_table('recommendation_job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('movie_choices', sa.JSON(), nullable=False),
+    sa.Column('genres', sa.JSON(), nullable=False),
+    sa.Column('error', sa.String(length=255), nullable=True),
+    sa.Column('saved', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_recommendation_job_status_updated_at', 'recommendation_job', ['status', 'updated_at'], unique=False)
+    op.create_table('recommendation_cache',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('recommendations', sa.JSON(), nullable=False),
+    sa.Column('hits', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('last_used_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index('ix_recommendation_cache_created_at', 'recommendation_cache', ['created_at'], unique=False)
+    op.create_index('ix_recommendation_cache_last_used_at', 'recommendation_cache', ['last_used_at'], unique=False)
+
+    # Backfill the normalized title, then keep only the newest row per
+    # (user, title) so the unique constraint can be added
+    with op.batch_alter_table('recommended_movies') as batch_op:
+        batch_op.add_column(sa.Column('title_key', sa.String(length=120), nullable=True))
+    connection = op.get_bind()
+    recommended_movies = sa.table('recommended_movies',
+                                  sa.column('id', sa.Integer), sa.column('title', sa.String),
+                                  sa.column('title_key', sa.String))
+    rows = connection.execute(sa.select(recommended_movies.c.id, recommended_movies.c.title)).all()
+    if rows:
+        connection.execute(recommended_movies.update()
+                           .where(recommended_movies.c.id == sa.bindparam('row_id'))
+                           .values(title_key=sa.bindparam('new_title_key')),
+                           [{'row_id': row_id, 'new_title_key': _normalize_title(title)} for row_id, title in rows])
+    _delete_duplicates('recommended_movies', ['user_id', 'title_key'], keep='MAX')
+    with op.batch_alter_table('recommended_movies') as batch_op:
+        batch_op.alter_column('title_key', existing_type=sa.String(length=120), nullable=False)
+        batch_op.create_unique_constraint('uq_recommended_movies_user_id_title_key', ['user_id', 'title_key'])
+    op.create_index('ix_recommended_movies_user_id_id', 'recommended_movies', ['user_id', sa.text('id DESC')], unique=False)
+
+    _delete_duplicates('genre_preferences', ['user_id', 'genre'])
+    with op.batch_alter_table('genre_preferences') as batch_op:
+        batch_op.create_unique_constraint('uq_genre_preferences_user_id_genre', ['user_id', 'genre'])
+
+    _delete_duplicates('movie_preferences', ['user_id', 'movie'])
+    with op.batch_alter_table('movie_preferences') as batch_op:
+        batch_op.create_unique_constraint('uq_movie_preferences_user_id_movie', ['user_id', 'movie'])
+
+
+def downgrade():
+    with op.batch_alter_table('movie_preferences') as batch_op:
+        batch_op.drop_constraint('uq_movie_preferences_user_id_movie', type_='unique')
+    with op.batch_alter_table('genre_preferences') as batch_op:
+        batch_op.drop_constraint('uq_genre_preferences_user_id_genre', type_='unique')
+    op.drop_index('ix_recommended_movies_user_id_id', table_name='recommended_movies')
+    with op.batch_alter_table('recommended_movies') as batch_op:
+        batch_op.drop_constraint('uq_recommended_movies_user_id_title_key', type_='unique')
+        batch_op.drop_column('title_key')
+    op.drop_index('ix_recommendation_cache_last_used_at', table_name='recommendation_cache')
+    op.drop_index('ix_recommendation_cache_created_at', table_name='recommendation_cache')
+    op.drop_table('recommendation_cache')
+    op.drop_index('ix_recommendation_job_status_updated_at', table_name='recommendation_job')
+    op.drop_table('recommendation_job')
+    op.drop_table('poster_cache')
@@ -0,0 +1,35 @@
+"""recommendation enrichment
+
+Revision ID: 9d4c6b1e8f27
+Revises: e7b3f0a4c9d2
+Create Date: 2026-10-17 15:42:51.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4c6b1e8f27'
+down_revision = 'e7b3f0a4c9d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows are left unenriched; the enrichment workers pick them up
+    with op.batch_alter_table('recommended_movies') as batch_op:
+        batch_op.add_column(sa.Column('tmdb_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('poster_path', sa.String(length=120), nullable=True))
+        batch_op.add_column(sa.Column('genre_ids', sa.JSON(), nullable=True))
+        batch_op.add_column(sa.Column('enriched_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_recommended_movies_enriched_at', ['enriched_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('recommended_movies') as batch_op:
+        batch_op.drop_index('ix_recommended_movies_enriched_at')
+        batch_op.drop_column('enriched_at')
+        batch_op.drop_column('genre_ids')
+        batch_op.drop_column('poster_path')
+        batch_op.drop_column('tmdb_id')
@@ -0,0 +1,26 @@
+"""recommended movies enrichment claim
+
+Revision ID: a3d8f1c6e2b9
+Revises: f4c9e2b7a1d6
+Create Date: 2026-10-17 19:47:05.281644
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d8f1c6e2b9'
+down_revision = 'f4c9e2b7a1d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('recommended_movies') as batch_op:
+        batch_op.add_column(sa.Column('enrichment_claimed_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('recommended_movies') as batch_op:
+        batch_op.drop_column('enrichment_claimed_at')
@@ -0,0 +1,29 @@
+"""widen user password
+
+Revision ID: b6e2d9a4c1f3
+Revises: 9d4c6b1e8f27
+Create Date: 2026-10-17 16:20:37.904512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e2d9a4c1f3'
+down_revision = '9d4c6b1e8f27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # scrypt hashes are about 160 characters
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column('password', existing_type=sa.String(length=60), type_=sa.String(length=255),
+                              existing_nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column('password', existing_type=sa.String(length=255), type_=sa.String(length=60),
+                              existing_nullable=False)
@@ -0,0 +1,31 @@
+"""calendar credentials
+
+Revision ID: c41d7e9a2f58
+Revises: 8b2e41c7d5a3
+Create Date: 2026-10-17 11:03:27.640918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7e9a2f58'
+down_revision = '8b2e41c7d5a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('calendar_credentials',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('token', sa.Text(), nullable=False),
+    sa.Column('expiry', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('calendar_credentials')
@@ -0,0 +1,98 @@
+"""rematch unmatched genres
+
+Revision ID: c8f1a2e5d7b4
+Revises: b6e2d9a4c1f3
+Create Date: 2026-10-17 18:05:12.447031
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8f1a2e5d7b4'
+down_revision = 'b6e2d9a4c1f3'
+branch_labels = None
+depends_on = None
+
+
+# Same as genres.GENRES and genres.COMBINED_GENRES at the time of this
+# revision, by bit: masks written here must not change if genres.py does
+_GENRES = [
+    ("action", ("actions",)),
+    ("adventure", ()),
+    ("animation", ("animated", "anime", "cartoon")),
+    ("comedy", ("comedies", "funny")),
+    ("crime", ("gangster", "heist")),
+    ("documentary", ("documentaries", "doc", "docs")),
+    ("drama", ("dramas",)),
+    ("family", ("kids", "children")),
+    ("fantasy", ()),
+    ("history", ("historical", "period")),
+    ("horror", ("scary", "slasher")),
+    ("music", ("musical", "musicals")),
+    ("mystery", ("whodunit",)),
+    ("romance", ("romantic",)),
+    ("scifi", ("science fiction", "sf", "sci fi")),
+    ("tv movie", ("tv",)),
+    ("thriller", ("thrillers", "suspense", "psychological thriller")),
+    ("war", ()),
+    ("western", ("westerns",)),
+]
+_COMBINED_GENRES = {
+    "romcom": ("romance", "comedy"),
+    "romantic comedy": ("romance", "comedy"),
+    "action adventure": ("action", "adventure"),
+    "action comedy": ("action", "comedy"),
+    "sci fi fantasy": ("scifi", "fantasy"),
+}
+
+
+def _normalize_genre_name(name):
+    return re.sub(r'\W+', '', name.lower())
+
+
+_MASKS_BY_NAME = {}
+for _bit, (_name, _aliases) in enumerate(_GENRES):
+    for _spelling in (_name, *_aliases):
+        _MASKS_BY_NAME[_normalize_genre_name(_spelling)] = 1 << _bit
+for _spelling, _names in _COMBINED_GENRES.items():
+    _MASKS_BY_NAME[_normalize_genre_name(_spelling)] = sum(_MASKS_BY_NAME[_normalize_genre_name(name)]
+                                                           for name in _names)
+
+
+def _genre_mask(genre_text):
+    # Same as genres.genre_mask at the time of this revision
+    text = str(genre_text or '')
+    mask = _MASKS_BY_NAME.get(_normalize_genre_name(text), 0)
+    for part in re.split(r'[,/&|;]+|\band\b', text):
+        mask |= _MASKS_BY_NAME.get(_normalize_genre_name(part), 0)
+        words = [word for word in re.split(r'[\s-]+', part) if word]
+        for i, word in enumerate(words):
+            mask |= _MASKS_BY_NAME.get(_normalize_genre_name(word), 0)
+            if i + 1 < len(words):
+                mask |= _MASKS_BY_NAME.get(_normalize_genre_name(word + words[i + 1]), 0)
+    return mask
+
+
+def upgrade():
+    # genre_mask() now also matches genres run together with spaces, such as
+    # "Crime Drama". Only rows nothing was matched for are rewritten, so masks
+    # set from TMDB genre ids are left alone.
+    connection = op.get_bind()
+    for table_name in ('recommended_movies', 'genre_preferences'):
+        table = sa.table(table_name, sa.column('genre', sa.String), sa.column('genre_mask', sa.Integer))
+        genres = connection.execute(sa.select(table.c.genre).where(table.c.genre_mask == 0).distinct()) \
+            .scalars().all()
+        updates = [{'old_genre': genre, 'new_mask': _genre_mask(genre)} for genre in genres if _genre_mask(genre)]
+        if updates:
+            connection.execute(table.update()
+                               .where(table.c.genre == sa.bindparam('old_genre'), table.c.genre_mask == 0)
+                               .values(genre_mask=sa.bindparam('new_mask')),
+                               updates)
+
+
+def downgrade():
+    pass
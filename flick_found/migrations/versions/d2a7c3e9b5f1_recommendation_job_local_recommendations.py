@@ -0,0 +1,26 @@
+"""recommendation job local recommendations
+
+Revision ID: d2a7c3e9b5f1
+Revises: c8f1a2e5d7b4
+Create Date: 2026-10-17 18:40:26.118530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a7c3e9b5f1'
+down_revision = 'c8f1a2e5d7b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('recommendation_job') as batch_op:
+        batch_op.add_column(sa.Column('local_recommendations', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('recommendation_job') as batch_op:
+        batch_op.drop_column('local_recommendations')
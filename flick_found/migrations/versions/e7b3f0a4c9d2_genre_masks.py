@@ -0,0 +1,98 @@
+"""genre masks
+
+Revision ID: e7b3f0a4c9d2
+Revises: 5a90d3be6c17
+Create Date: 2026-10-17 12:26:09.834105
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3f0a4c9d2'
+down_revision = '5a90d3be6c17'
+branch_labels = None
+depends_on = None
+
+
+# Same as genres.GENRES and genres.COMBINED_GENRES at the time of this
+# revision, by bit: masks written here must not change if genres.py does
+_GENRES = [
+    ("action", ("actions",)),
+    ("adventure", ()),
+    ("animation", ("animated", "anime", "cartoon")),
+    ("comedy", ("comedies", "funny")),
+    ("crime", ("gangster", "heist")),
+    ("documentary", ("documentaries", "doc", "docs")),
+    ("drama", ("dramas",)),
+    ("family", ("kids", "children")),
+    ("fantasy", ()),
+    ("history", ("historical", "period")),
+    ("horror", ("scary", "slasher")),
+    ("music", ("musical", "musicals")),
+    ("mystery", ("whodunit",)),
+    ("romance", ("romantic",)),
+    ("scifi", ("science fiction", "sf", "sci fi")),
+    ("tv movie", ("tv",)),
+    ("thriller", ("thrillers", "suspense", "psychological thriller")),
+    ("war", ()),
+    ("western", ("westerns",)),
+]
+_COMBINED_GENRES = {
+    "romcom": ("romance", "comedy"),
+    "romantic comedy": ("romance", "comedy"),
+    "action adventure": ("action", "adventure"),
+    "action comedy": ("action", "comedy"),
+    "sci fi fantasy": ("scifi", "fantasy"),
+}
+
+
+def _normalize_genre_name(name):
+    return re.sub(r'\W+', '', name.lower())
+
+
+_MASKS_BY_NAME = {}
+for _bit, (_name, _aliases) in enumerate(_GENRES):
+    for _spelling in (_name, *_aliases):
+        _MASKS_BY_NAME[_normalize_genre_name(_spelling)] = 1 << _bit
+for _spelling, _names in _COMBINED_GENRES.items():
+    _MASKS_BY_NAME[_normalize_genre_name(_spelling)] = sum(_MASKS_BY_NAME[_normalize_genre_name(name)]
+                                                           for name in _names)
+
+
+def _genre_mask(genre_text):
+    # Same as genres.genre_mask at the time of this revision
+    text = str(genre_text or '')
+    mask = _MASKS_BY_NAME.get(_normalize_genre_name(text), 0)
+    for part in re.split(r'[,/&|;]+|\band\b', text):
+        mask |= _MASKS_BY_NAME.get(_normalize_genre_name(part), 0)
+    return mask
+
+
+def _backfill(table_name):
+    # Every distinct genre text is parsed once and written with one UPDATE
+    connection = op.get_bind()
+    table = sa.table(table_name, sa.column('genre', sa.String), sa.column('genre_mask', sa.Integer))
+    genres = connection.execute(sa.select(table.c.genre).distinct()).scalars().all()
+    updates = [{'old_genre': genre, 'new_mask': _genre_mask(genre)} for genre in genres if _genre_mask(genre)]
+    if updates:
+        connection.execute(table.update()
+                           .where(table.c.genre == sa.bindparam('old_genre'))
+                           .values(genre_mask=sa.bindparam('new_mask')),
+                           updates)
+
+
+def upgrade():
+    for table_name in ('recommended_movies', 'genre_preferences'):
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.add_column(sa.Column('genre_mask', sa.Integer(), nullable=False, server_default='0'))
+        _backfill(table_name)
+
+
+def downgrade():
+    for table_name in ('genre_preferences', 'recommended_movies'):
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.drop_column('genre_mask')
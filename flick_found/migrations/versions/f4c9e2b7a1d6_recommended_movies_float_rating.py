@@ -0,0 +1,32 @@
+"""recommended movies float rating
+
+Revision ID: f4c9e2b7a1d6
+Revises: d2a7c3e9b5f1
+Create Date: 2026-10-17 19:12:48.530917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4c9e2b7a1d6'
+down_revision = 'd2a7c3e9b5f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Ratings are out of 10 with one decimal ("8.3"), which an integer column
+    # rejects on PostgreSQL. SQLite kept whatever it was given, including
+    # text such as "8.1/10"; CAST reads the number at the start of it.
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("UPDATE recommended_movies SET rating = CAST(rating AS REAL) WHERE typeof(rating) = 'text'")
+    with op.batch_alter_table('recommended_movies') as batch_op:
+        batch_op.alter_column('rating', existing_type=sa.Integer(), type_=sa.Float(), existing_nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('recommended_movies') as batch_op:
+        batch_op.alter_column('rating', existing_type=sa.Float(), type_=sa.Integer(), existing_nullable=False,
+                              postgresql_using='round(rating)::integer')
@@ -0,0 +1,188 @@
+import re
+import sqlite3
+from datetime import datetime
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.engine import Engine
+
+import metrics
+from password_hashing import hash_password, needs_rehash, verify_password
+
+
+db = SQLAlchemy()
+
+
+@event.listens_for(Engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers keep going while a writer commits, and busy_timeout
+    # makes concurrent writers wait for the lock instead of failing
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA busy_timeout=5000')
+        cursor.close()
+
+
+def normalize_title(title):
+    return re.sub(r'\s+', ' ', title).strip().lower()[:120]
+
+
+def upsert(model, rows, conflict_columns, update_columns=()):
+    # Inserts all rows in one multi-row INSERT. Rows that clash with an
+    # existing one on conflict_columns update update_columns, or are skipped
+    # when there are none. The caller commits. Returns the statement's row
+    # count: with no update_columns, the number of rows inserted.
+    if not rows:
+        return 0
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'mysql':
+        stmt = mysql.insert(model).values(rows)
+        # MySQL has no "do nothing", so rewrite a key column with itself
+        columns = update_columns or conflict_columns[:1]
+        stmt = stmt.on_duplicate_key_update({column: stmt.inserted[column] for column in columns})
+    else:
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(model).values(rows)
+        if update_columns:
+            stmt = stmt.on_conflict_do_update(index_elements=conflict_columns,
+                                              set_={column: stmt.excluded[column] for column in update_columns})
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=conflict_columns)
+    return db.session.execute(stmt).rowcount
+
+
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password = db.Column(db.String(255), nullable=False)
+
+    genre_preferences = db.relationship('GenrePreferences', backref='user', lazy=True)
+    movie_preferences = db.relationship('MoviePreferences', backref='user', lazy=True)
+
+    # Both raise password_hashing.HashingBusy when the hashing pool is full
+    def set_password(self, password):
+        self.password = hash_password(password)
+
+    def check_password(self, password):
+        # A hash made with older parameters is replaced with a current one,
+        # which the caller commits
+        if not verify_password(self.password, password):
+            return False
+        if needs_rehash(self.password):
+            self.password = hash_password(password)
+            metrics.increment('password_rehashed_total')
+        return True
+
+    def __repr__(self):
+        return f"User('{self.email}')"
+
+
+class RecommendedMovies(db.Model):
+    __table_args__ = (db.UniqueConstraint('user_id', 'title_key', name='uq_recommended_movies_user_id_title_key'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    title = db.Column(db.String(120), nullable=False)
+    title_key = db.Column(db.String(120), nullable=False)  # normalize_title(title)
+    release_date = db.Column(db.String(15), nullable=False)
+    rating = db.Column(db.Float, nullable=False)
+    genre = db.Column(db.String(120), nullable=False)
+    genre_mask = db.Column(db.Integer, nullable=False, default=0)  # genres.genre_mask(genre)
+    # Filled in from TMDB by enrichment.py after the row is saved; until then
+    # enriched_at is null and the fields above are as the LLM gave them. An
+    # enriched row with no tmdb_id had no match.
+    tmdb_id = db.Column(db.Integer)
+    poster_path = db.Column(db.String(120))
+    genre_ids = db.Column(db.JSON)
+    enriched_at = db.Column(db.DateTime, index=True)
+    # When a worker took the row on for enrichment; see enrichment.py
+    enrichment_claimed_at = db.Column(db.DateTime)
+
+
+# Serves the "latest recommendations for a user" query without a sort
+db.Index('ix_recommended_movies_user_id_id', RecommendedMovies.user_id, RecommendedMovies.id.desc())
+
+
+class GenrePreferences(db.Model):
+    __table_args__ = (db.UniqueConstraint('user_id', 'genre', name='uq_genre_preferences_user_id_genre'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    genre = db.Column(db.String(20), nullable=False)  # Assuming storing genre as a string
+    genre_mask = db.Column(db.Integer, nullable=False, default=0)  # genres.genre_mask(genre)
+
+    def __repr__(self):
+        return f"Genre_Preferences(user_id={self.user_id}, genre={self.genre})"
+
+
+class MoviePreferences(db.Model):
+    __table_args__ = (db.UniqueConstraint('user_id', 'movie', name='uq_movie_preferences_user_id_movie'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    movie = db.Column(db.String(100), nullable=False)  # Can be adjusted we have long*** movie titles
+
+    def __repr__(self):
+        return f"Movie_Preferences(user_id={self.user_id}, genre={self.movie})"
+
+
+class PosterCache(db.Model):
+    # One row per normalized title. A row with no tmdb_id records that TMDB
+    # had no match, so we don't keep searching for it on every page view.
+    title_key = db.Column(db.String(120), primary_key=True)
+    tmdb_id = db.Column(db.Integer)
+    poster_path = db.Column(db.String(120))
+    fetched_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"PosterCache(title_key={self.title_key}, tmdb_id={self.tmdb_id})"
+
+
+class RecommendationJob(db.Model):
+    # A queued /generate request. Rows are the source of truth for the job
+    # queue, so pending work survives a worker restart.
+    __table_args__ = (db.Index('ix_recommendation_job_status_updated_at', 'status', 'updated_at'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending, running, done or failed
+    movie_choices = db.Column(db.JSON, nullable=False)
+    genres = db.Column(db.JSON, nullable=False)
+    error = db.Column(db.String(255))
+    requested = db.Column(db.Integer, nullable=False, default=30)  # Recommendations to ask OpenAI for
+    saved = db.Column(db.Integer, nullable=False, default=0)  # Recommendations saved so far
+    # Similar movies /generate saved before queueing the job; cached together
+    # with the job's own so the cached set is complete
+    local_recommendations = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"RecommendationJob(id={self.id}, user_id={self.user_id}, status={self.status})"
+
+
+class RecommendationCache(db.Model):
+    # Processed recommendations for one normalized (movies, genres) input,
+    # shared by every user who submits the same seeds
+    key = db.Column(db.String(64), primary_key=True)
+    recommendations = db.Column(db.JSON, nullable=False)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    last_used_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f"RecommendationCache(key={self.key}, hits={self.hits})"
+
+
+class CalendarCredentials(db.Model):
+    # A user's Google OAuth token, as written by Credentials.to_json()
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    token = db.Column(db.Text, nullable=False)
+    expiry = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"CalendarCredentials(user_id={self.user_id}, expiry={self.expiry})"
@@ -0,0 +1,73 @@
+import hashlib
+import os
+import threading
+import time
+from collections import namedtuple
+
+from cachetools import TTLCache
+from sqlalchemy import func
+
+import metrics
+from models import db, RecommendedMovies
+
+
+# How long a rendered fragment is kept; posters found later show up after this
+FRAGMENT_TTL_SECONDS = int(os.environ.get('FRAGMENT_TTL_SECONDS', 600))
+FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 2048))
+# How long a user's newest recommendation id is trusted without asking the
+# database. Writes made by this process invalidate it straight away; this
+# bounds how stale it can be after a write from another worker.
+LATEST_ID_TTL_SECONDS = float(os.environ.get('LATEST_ID_TTL_SECONDS', 5))
+
+# latest_id is the user's newest RecommendedMovies id (0 when they have
+# none), enriched_at when one of their rows was last enriched from TMDB,
+# changed_at the wall-clock time we first saw either, and checked_at when
+# they were last read from the database
+LatestRecommendation = namedtuple('LatestRecommendation', ['latest_id', 'enriched_at', 'changed_at', 'checked_at'])
+
+_fragments = TTLCache(maxsize=FRAGMENT_CACHE_SIZE, ttl=FRAGMENT_TTL_SECONDS)
+_latest = {}
+_lock = threading.Lock()
+
+
+def latest_recommendation(user_id):
+    with _lock:
+        entry = _latest.get(user_id)
+    if entry and time.monotonic() - entry.checked_at < LATEST_ID_TTL_SECONDS:
+        return entry
+    latest_id, enriched_at = db.session.query(func.max(RecommendedMovies.id), func.max(RecommendedMovies.enriched_at)) \
+        .filter_by(user_id=user_id) \
+        .one()
+    latest_id = latest_id or 0
+    unchanged = entry and (entry.latest_id, entry.enriched_at) == (latest_id, enriched_at)
+    changed_at = entry.changed_at if unchanged else time.time()
+    entry = LatestRecommendation(latest_id, enriched_at, changed_at, time.monotonic())
+    with _lock:
+        _latest[user_id] = entry
+    return entry
+
+
+def recommendations_changed(user_id):
+    # Called after a user's recommendations are written so the next page
+    # view reads the new latest id and renders fresh cards
+    with _lock:
+        _latest.pop(user_id, None)
+        for key in [key for key in _fragments if key[0] == 'recommendations' and key[1] == user_id]:
+            _fragments.pop(key, None)
+
+
+def cached_fragment(key, render):
+    # Returns the HTML cached under key, calling render() to produce it on a
+    # miss. Two requests missing at once both render; the result is the same.
+    with _lock:
+        html = _fragments.get(key)
+    metrics.increment('fragment_cache_requests_total', fragment=key[0], result='miss' if html is None else 'hit')
+    if html is None:
+        html = render()
+        with _lock:
+            _fragments[key] = html
+    return html
+
+
+def page_etag(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
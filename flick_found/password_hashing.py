@@ -0,0 +1,95 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+import metrics
+from rate_limiter import admit
+
+
+# Password hashes are deliberately slow, so they run on a small pool of
+# their own instead of in the request thread. The request thread still waits
+# for its hash, so only so many of a worker's GUNICORN_THREADS may be hashing
+# at once; a login beyond that is turned away straight away, leaving the rest
+# of the threads to serve pages.
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 4))
+# Request threads per worker kept free of password hashing
+PASSWORD_HASH_FREE_THREADS = int(os.environ.get('PASSWORD_HASH_FREE_THREADS', max(1, GUNICORN_THREADS // 2)))
+PASSWORD_HASH_SLOTS = max(1, GUNICORN_THREADS - PASSWORD_HASH_FREE_THREADS)
+PASSWORD_HASH_WORKERS = min(PASSWORD_HASH_SLOTS,
+                            int(os.environ.get('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2))))
+
+# Login and sign-up attempts allowed per client IP and per email address,
+# shared by every worker through the rate limiter's buckets
+LOGIN_IP_RATE_PER_MINUTE = float(os.environ.get('LOGIN_IP_RATE_PER_MINUTE', 20))
+LOGIN_IP_BURST = float(os.environ.get('LOGIN_IP_BURST', 10))
+LOGIN_EMAIL_RATE_PER_MINUTE = float(os.environ.get('LOGIN_EMAIL_RATE_PER_MINUTE', 5))
+LOGIN_EMAIL_BURST = float(os.environ.get('LOGIN_EMAIL_BURST', 5))
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_SLOTS)
+
+
+class HashingBusy(Exception):
+    # Every request thread allowed to hash already is
+    pass
+
+
+def full_method(method):
+    # The method with werkzeug's defaults filled in, as it is written at the
+    # start of every hash it makes
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        defaults = [str(2 ** 15), '8', '1']
+    elif name == 'pbkdf2':
+        defaults = ['sha256', str(DEFAULT_PBKDF2_ITERATIONS)]
+    else:
+        return method
+    return ':'.join([name] + args + defaults[len(args):])
+
+
+CURRENT_METHOD = full_method(PASSWORD_HASH_METHOD)
+
+
+def admit_login(ip, email):
+    # False when this IP address or email has made too many attempts lately
+    return (admit('login-ip', ip, LOGIN_IP_RATE_PER_MINUTE / 60, LOGIN_IP_BURST)
+            and admit('login-email', email.strip().lower(), LOGIN_EMAIL_RATE_PER_MINUTE / 60, LOGIN_EMAIL_BURST))
+
+
+def _run(operation, function, *args):
+    if not _slots.acquire(blocking=False):
+        metrics.increment('password_hash_rejected_total')
+        raise HashingBusy('Password hashing is at capacity')
+    submitted = time.monotonic()
+
+    def task():
+        started = time.monotonic()
+        metrics.observe('password_hash_queue_seconds', started - submitted, operation=operation)
+        try:
+            return function(*args)
+        finally:
+            metrics.observe('password_hash_seconds', time.monotonic() - started, operation=operation)
+
+    try:
+        # At most PASSWORD_HASH_SLOTS hashes are in the pool, so this waits
+        # behind only a few others
+        return _executor.submit(task).result()
+    finally:
+        _slots.release()
+
+
+def hash_password(password):
+    return _run('hash', generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(password_hash, password):
+    return _run('verify', check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    # True for hashes made with other parameters than PASSWORD_HASH_METHOD
+    return password_hash.split('$', 1)[0] != CURRENT_METHOD
@@ -0,0 +1,90 @@
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from cachetools import LRUCache
+from sqlalchemy.exc import SQLAlchemyError
+
+import metrics
+from instrumentation import timed
+from models import db, normalize_title, PosterCache
+from tmdb import LOOKUP_FAILED, search_movies
+
+
+# How long a TMDB match is trusted before we search for the title again
+POSTER_TTL = timedelta(days=int(os.environ.get('POSTER_CACHE_TTL_DAYS', 30)))
+# "No result" answers expire sooner in case TMDB adds the movie later
+NO_RESULT_TTL = timedelta(days=int(os.environ.get('POSTER_CACHE_NO_RESULT_TTL_DAYS', 1)))
+MEMORY_CACHE_SIZE = int(os.environ.get('POSTER_CACHE_MEMORY_SIZE', 4096))
+
+CachedPoster = namedtuple('CachedPoster', ['tmdb_id', 'poster_path', 'fetched_at'])
+
+_memory = LRUCache(maxsize=MEMORY_CACHE_SIZE)
+_memory_lock = threading.Lock()
+
+
+def _is_fresh(entry, now):
+    ttl = POSTER_TTL if entry.tmdb_id is not None else NO_RESULT_TTL
+    return entry.fetched_at + ttl > now
+
+
+@timed('posters.lookup')
+def lookup_posters(titles):
+    # Returns a CachedPoster (or None when the lookup failed) for each title.
+    # Checks the in-process LRU, then the poster_cache table, and only
+    # searches TMDB for titles missing from both.
+    keys = [normalize_title(title) for title in titles]
+    now = datetime.utcnow()
+    found = {}
+
+    with _memory_lock:
+        for key in set(keys):
+            entry = _memory.get(key)
+            if entry and _is_fresh(entry, now):
+                found[key] = entry
+
+    missing = [key for key in dict.fromkeys(keys) if key not in found]
+    metrics.increment('poster_cache_lookups_total', len(found), source='memory')
+    if missing:
+        rows = {row.title_key: row for row in
+                PosterCache.query.filter(PosterCache.title_key.in_(missing)).all()}
+        to_fetch = []
+        for key in missing:
+            row = rows.get(key)
+            entry = row and CachedPoster(row.tmdb_id, row.poster_path, row.fetched_at)
+            if entry and _is_fresh(entry, now):
+                found[key] = entry
+            else:
+                to_fetch.append(key)
+
+        metrics.increment('poster_cache_lookups_total', len(missing) - len(to_fetch), source='database')
+        metrics.increment('poster_cache_lookups_total', len(to_fetch), source='tmdb')
+        if to_fetch:
+            title_for_key = {}
+            for title, key in zip(titles, keys):
+                title_for_key.setdefault(key, title)
+            results = search_movies([title_for_key[key] for key in to_fetch])
+            for key, movie in zip(to_fetch, results):
+                if movie is LOOKUP_FAILED:
+                    # Not cached, so the next page view tries again
+                    continue
+                entry = CachedPoster(movie['id'] if movie else None,
+                                     movie.get('poster_path') if movie else None, now)
+                found[key] = entry
+                row = rows.get(key) or PosterCache(title_key=key)
+                row.tmdb_id, row.poster_path, row.fetched_at = entry
+                db.session.add(row)
+            try:
+                db.session.commit()
+            except SQLAlchemyError as e:
+                # Most likely another request cached the same title first
+                db.session.rollback()
+                print(f"Unable to save poster cache entries: {e}")
+
+        with _memory_lock:
+            for key in missing:
+                if key in found:
+                    _memory[key] = found[key]
+
+    return [found.get(key) for key in keys]
@@ -0,0 +1,171 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+import metrics
+from tmdb import get_image
+
+
+# Poster images downloaded from TMDB are kept here and served by /poster.
+# objects/ holds each image once, named by the sha256 of its bytes, and
+# refs/<size>/<tmdb path> holds the digest of the image for that poster size.
+POSTER_FILES_DIR = os.environ.get('POSTER_FILES_DIR',
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), 'poster_files'))
+# Once the images take more than this, the least recently served are deleted
+POSTER_FILES_MAX_BYTES = int(os.environ.get('POSTER_FILES_MAX_MB', 512)) * 1024 * 1024
+# Eviction frees space down to this fraction of the limit, so it doesn't run
+# again on the very next download
+EVICT_TO = 0.9
+# A served image's mtime is its last use; it is refreshed at most this often
+TOUCH_INTERVAL = 3600
+
+# Raster formats only: SVG can carry script, and these are served publicly
+# from our own origin
+MIMETYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.webp': 'image/webp'}
+_POSTER_NAME = re.compile(r'^[A-Za-z0-9_-]{1,100}\.(jpg|jpeg|png|webp)$')
+
+PosterFile = namedtuple('PosterFile', ['path', 'digest', 'mimetype'])
+
+_stored_bytes = None
+_bytes_lock = threading.Lock()
+_evict_lock = threading.Lock()
+_download_locks = {}
+_download_locks_lock = threading.Lock()
+
+
+def is_poster_name(name):
+    # TMDB poster paths are a single file name such as "abc123.jpg"
+    return bool(_POSTER_NAME.match(name))
+
+
+def _ref_path(size, name):
+    return os.path.join(POSTER_FILES_DIR, 'refs', size, name)
+
+
+def _object_path(digest, extension):
+    return os.path.join(POSTER_FILES_DIR, 'objects', digest[:2], digest + extension)
+
+
+def _write_atomically(path, data):
+    # Readers in any process see the whole file or none of it
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _stored(size, name):
+    try:
+        with open(_ref_path(size, name)) as f:
+            digest = f.read().strip()
+        path = _object_path(digest, os.path.splitext(name)[1].lower())
+        mtime = os.stat(path).st_mtime
+    except (FileNotFoundError, ValueError):
+        return None
+    if time.time() - mtime > TOUCH_INTERVAL:
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+    return PosterFile(path, digest, MIMETYPES[os.path.splitext(name)[1].lower()])
+
+
+def _download_lock(size, name):
+    with _download_locks_lock:
+        return _download_locks.setdefault((size, name), threading.Lock())
+
+
+def get_poster_file(size, name):
+    # Returns the PosterFile for this size of the poster, downloading it from
+    # TMDB the first time. Raises TMDBError when that download fails.
+    poster = _stored(size, name)
+    if poster:
+        metrics.increment('poster_files_requests_total', result='hit')
+        return poster
+    lock = _download_lock(size, name)
+    with lock:
+        # Another request may have downloaded it while we waited
+        poster = _stored(size, name)
+        if poster:
+            metrics.increment('poster_files_requests_total', result='hit')
+            return poster
+        metrics.increment('poster_files_requests_total', result='miss')
+        try:
+            content, content_type = get_image(size, name)
+            digest = hashlib.sha256(content).hexdigest()
+            path = _object_path(digest, os.path.splitext(name)[1].lower())
+            if not os.path.exists(path):
+                _write_atomically(path, content)
+                _stored_bytes_added(len(content))
+            _write_atomically(_ref_path(size, name), digest.encode())
+        finally:
+            with _download_locks_lock:
+                _download_locks.pop((size, name), None)
+    return PosterFile(path, digest, MIMETYPES[os.path.splitext(name)[1].lower()])
+
+
+def _stored_bytes_added(count):
+    global _stored_bytes
+    with _bytes_lock:
+        if _stored_bytes is not None:
+            _stored_bytes += count
+        over = _stored_bytes is None or _stored_bytes > POSTER_FILES_MAX_BYTES
+    if over and _evict_lock.acquire(blocking=False):
+        try:
+            evict()
+        finally:
+            _evict_lock.release()
+
+
+def _walk(directory):
+    for root, dirs, names in os.walk(directory):
+        for name in names:
+            if not name.startswith('.'):
+                yield os.path.join(root, name)
+
+
+def evict():
+    # Deletes the least recently served images until they fit in
+    # POSTER_FILES_MAX_BYTES, then drops refs to images that are gone. Every
+    # process shares the directory, so the sizes are read from disk.
+    global _stored_bytes
+    objects = []
+    for path in _walk(os.path.join(POSTER_FILES_DIR, 'objects')):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        objects.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in objects)
+    if total > POSTER_FILES_MAX_BYTES:
+        evicted = 0
+        for _, size, path in sorted(objects):
+            if total <= POSTER_FILES_MAX_BYTES * EVICT_TO:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        metrics.increment('poster_files_evictions_total', evicted)
+        for ref in _walk(os.path.join(POSTER_FILES_DIR, 'refs')):
+            try:
+                with open(ref) as f:
+                    digest = f.read().strip()
+                if not os.path.exists(_object_path(digest, os.path.splitext(ref)[1].lower())):
+                    os.unlink(ref)
+            except (FileNotFoundError, ValueError):
+                continue
+    with _bytes_lock:
+        _stored_bytes = total
+    metrics.set_gauge('poster_files_bytes', total)
@@ -0,0 +1,53 @@
+import os
+import time
+
+from flask import session
+from sqlalchemy import exists
+
+from models import db, User, GenrePreferences, MoviePreferences
+
+
+# How long the copy of a user's profile kept in their session is trusted
+PROFILE_TTL_SECONDS = int(os.environ.get('PROFILE_TTL_SECONDS', 300))
+
+
+def load_profile(criterion):
+    # Fetches a user, whether they have movie preferences and their genre
+    # preferences in a single query. Returns (user, profile), or (None, None)
+    # when no user matches.
+    has_movies = exists().where(MoviePreferences.user_id == User.id)
+    rows = db.session.query(User, has_movies.label('has_movies'), GenrePreferences.genre, GenrePreferences.genre_mask) \
+        .outerjoin(GenrePreferences, GenrePreferences.user_id == User.id) \
+        .filter(criterion) \
+        .all()
+    if not rows:
+        return None, None
+    user = rows[0].User
+    profile = {
+        'user_id': user.id,
+        'has_movies': bool(rows[0].has_movies),
+        'genres': [row.genre for row in rows if row.genre],
+        'genre_mask': _combined_mask(row.genre_mask for row in rows),
+        'loaded_at': time.time()
+    }
+    return user, profile
+
+
+def _combined_mask(masks):
+    combined = 0
+    for mask in masks:
+        combined |= mask or 0
+    return combined
+
+
+def get_profile(user_id):
+    profile = session.get('profile')
+    if not profile or profile['user_id'] != user_id or 'genre_mask' not in profile \
+            or time.time() - profile['loaded_at'] > PROFILE_TTL_SECONDS:
+        profile = load_profile(User.id == user_id)[1]
+        session['profile'] = profile
+    return profile
+
+
+def invalidate_profile():
+    session.pop('profile', None)
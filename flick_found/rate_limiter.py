@@ -0,0 +1,224 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import metrics
+
+
+# Token buckets shared by every worker process on the host, kept in a small
+# SQLite file so no extra service is needed. Each upstream refills at `rate`
+# tokens a second up to `burst`; every outbound call takes one token.
+RATE_LIMIT_DB = os.environ.get('RATE_LIMIT_DB',
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rate_limits.db'))
+RATE_LIMITS = {
+    'tmdb': (float(os.environ.get('TMDB_RATE_PER_SECOND', 35)), float(os.environ.get('TMDB_RATE_BURST', 40))),
+    'openai': (float(os.environ.get('OPENAI_RATE_PER_MINUTE', 60)) / 60,
+               float(os.environ.get('OPENAI_RATE_BURST', 5))),
+}
+
+# Page loads go ahead of background work: background callers wait while any
+# interactive caller is waiting, and leave this share of the burst untouched
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+BACKGROUND_RESERVE = float(os.environ.get('RATE_LIMIT_BACKGROUND_RESERVE', 0.25))
+# Longest single sleep, so waiters notice a change in priority promptly
+MAX_SLEEP = 0.25
+# Share of admit() calls that also delete idle per-client buckets
+PRUNE_PROBABILITY = 0.01
+
+_lane = ContextVar('rate_limit_lane', default=INTERACTIVE)
+_local = threading.local()
+
+
+class RateLimited(Exception):
+    # No token became available within the caller's timeout
+    def __init__(self, upstream, retry_after):
+        super().__init__(f'{upstream} rate limit budget exhausted; retry in {retry_after:.2f}s')
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+def current_lane():
+    return _lane.get()
+
+
+@contextmanager
+def lane(name):
+    # Calls made inside the block take tokens from the given lane
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def _connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(RATE_LIMIT_DB, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS buckets (upstream TEXT PRIMARY KEY, tokens REAL, updated_at REAL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS waiters (upstream TEXT, lane TEXT, pid INTEGER, waiting INTEGER, '
+                     'PRIMARY KEY (upstream, lane, pid))')
+        _local.conn = conn
+    return conn
+
+
+def _try_take(upstream, lane_name, tokens):
+    # Takes tokens if the lane may; otherwise returns how long until it could
+    rate, burst = RATE_LIMITS[upstream]
+    conn = _connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        now = time.time()
+        row = conn.execute('SELECT tokens, updated_at FROM buckets WHERE upstream = ?', (upstream,)).fetchone()
+        level = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+        floor = 0
+        if lane_name == BACKGROUND:
+            floor = burst * BACKGROUND_RESERVE
+            if _interactive_waiting(conn, upstream):
+                conn.execute('ROLLBACK')
+                return MAX_SLEEP
+        if level - tokens < floor:
+            conn.execute('ROLLBACK')
+            return (floor + tokens - level) / rate
+        conn.execute('INSERT OR REPLACE INTO buckets (upstream, tokens, updated_at) VALUES (?, ?, ?)',
+                     (upstream, level - tokens, now))
+        conn.execute('COMMIT')
+        return 0
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def _interactive_waiting(conn, upstream):
+    # Rows left by a process killed while it waited would hold background
+    # work back for good, so they are dropped here rather than left for
+    # queue_depths()
+    waiting = 0
+    for pid, count in conn.execute('SELECT pid, waiting FROM waiters WHERE upstream = ? AND lane = ? AND waiting > 0',
+                                   (upstream, INTERACTIVE)).fetchall():
+        if _is_alive(pid):
+            waiting += count
+        else:
+            conn.execute('DELETE FROM waiters WHERE pid = ?', (pid,))
+    return waiting
+
+
+def _set_waiting(upstream, lane_name, change):
+    conn = _connection()
+    conn.execute('INSERT INTO waiters (upstream, lane, pid, waiting) VALUES (?, ?, ?, ?) '
+                 'ON CONFLICT (upstream, lane, pid) DO UPDATE SET waiting = MAX(waiting + excluded.waiting, 0)',
+                 (upstream, lane_name, os.getpid(), change))
+
+
+def acquire(upstream, timeout=None, tokens=1):
+    # Takes tokens for one call to upstream, waiting up to timeout seconds
+    # (None waits as long as it takes, 0 fails straight away). Raises
+    # RateLimited when the wait would run past the timeout.
+    lane_name = current_lane()
+    start = time.monotonic()
+    wait = _try_take(upstream, lane_name, tokens)
+    if wait == 0:
+        metrics.increment('rate_limiter_acquired_total', upstream=upstream, lane=lane_name, waited='no')
+        return
+    deadline = None if timeout is None else start + timeout
+    if deadline is not None and start + wait > deadline:
+        metrics.increment('rate_limiter_rejected_total', upstream=upstream, lane=lane_name)
+        raise RateLimited(upstream, wait)
+
+    _set_waiting(upstream, lane_name, 1)
+    try:
+        while wait:
+            now = time.monotonic()
+            if deadline is not None and now + min(wait, MAX_SLEEP) > deadline:
+                metrics.increment('rate_limiter_rejected_total', upstream=upstream, lane=lane_name)
+                raise RateLimited(upstream, wait)
+            # A little jitter keeps waiting processes from waking in lockstep
+            time.sleep(min(wait, MAX_SLEEP) * random.uniform(1, 1.1))
+            wait = _try_take(upstream, lane_name, tokens)
+    finally:
+        _set_waiting(upstream, lane_name, -1)
+    metrics.increment('rate_limiter_acquired_total', upstream=upstream, lane=lane_name, waited='yes')
+    metrics.observe('rate_limiter_wait_seconds', time.monotonic() - start, upstream=upstream, lane=lane_name)
+
+
+def throttle(upstream, seconds):
+    # The upstream told us to slow down (a 429): empty the bucket so no
+    # process calls it again for about `seconds`
+    rate, burst = RATE_LIMITS[upstream]
+    conn = _connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('INSERT OR REPLACE INTO buckets (upstream, tokens, updated_at) VALUES (?, ?, ?)',
+                     (upstream, -rate * seconds, time.time()))
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    metrics.increment('rate_limiter_throttled_total', upstream=upstream)
+
+
+def admit(scope, key, rate, burst):
+    # Takes a token from the bucket for one client (an IP address, an email)
+    # without waiting; False when it is empty. Every key in a scope shares
+    # rate and burst. Clients come and go, so buckets that have filled back
+    # up are deleted now and then.
+    conn = _connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        now = time.time()
+        bucket = f'{scope}:{key}'
+        row = conn.execute('SELECT tokens, updated_at FROM buckets WHERE upstream = ?', (bucket,)).fetchone()
+        level = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+        admitted = level >= 1
+        if admitted:
+            conn.execute('INSERT OR REPLACE INTO buckets (upstream, tokens, updated_at) VALUES (?, ?, ?)',
+                         (bucket, level - 1, now))
+        if random.random() < PRUNE_PROBABILITY:
+            conn.execute('DELETE FROM buckets WHERE upstream LIKE ? AND tokens + (? - updated_at) * ? >= ?',
+                         (f'{scope}:%', now, rate, burst))
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    if not admitted:
+        metrics.increment('rate_limiter_admission_rejected_total', scope=scope)
+    return admitted
+
+
+def queue_depths():
+    # Callers waiting for a token in every process, by (upstream, lane).
+    # Rows left behind by processes that died are dropped.
+    conn = _connection()
+    rows = conn.execute('SELECT upstream, lane, pid, waiting FROM waiters').fetchall()
+    depths = {(upstream, lane_name): 0 for upstream in RATE_LIMITS for lane_name in (INTERACTIVE, BACKGROUND)}
+    for upstream, lane_name, pid, waiting in rows:
+        if not _is_alive(pid):
+            conn.execute('DELETE FROM waiters WHERE pid = ?', (pid,))
+            continue
+        depths[upstream, lane_name] = depths.get((upstream, lane_name), 0) + waiting
+    return depths
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _collect_queue_depths():
+    for (upstream, lane_name), depth in queue_depths().items():
+        metrics.set_gauge('rate_limiter_queue_depth', depth, upstream=upstream, lane=lane_name)
+
+
+metrics.register_collector(_collect_queue_depths)
@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+import random
+import re
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import SQLAlchemyError
+
+import metrics
+from models import db, RecommendationCache
+
+
+RECOMMENDATION_CACHE_TTL = timedelta(hours=int(os.environ.get('RECOMMENDATION_CACHE_TTL_HOURS', 24 * 7)))
+# Least recently used entries beyond this many are evicted
+RECOMMENDATION_CACHE_MAX_ENTRIES = int(os.environ.get('RECOMMENDATION_CACHE_MAX_ENTRIES', 5000))
+# Share of stores that also evict; the table may run a little over
+# RECOMMENDATION_CACHE_MAX_ENTRIES in between
+EVICTION_PROBABILITY = float(os.environ.get('RECOMMENDATION_CACHE_EVICTION_PROBABILITY', 0.05))
+
+
+def _normalize(value):
+    return re.sub(r'\s+', ' ', value).strip().lower()
+
+
+def cache_key(movie_choices, genres):
+    # Same seeds in any order, case or spacing give the same key
+    movies = sorted({_normalize(movie) for movie in movie_choices if movie.strip()})
+    genres = sorted({_normalize(genre) for genre in genres if genre.strip()})
+    return hashlib.sha256(json.dumps([movies, genres]).encode()).hexdigest()
+
+
+def get_cached_recommendations(movie_choices, genres):
+    entry = db.session.get(RecommendationCache, cache_key(movie_choices, genres))
+    now = datetime.utcnow()
+    if entry is None or entry.created_at + RECOMMENDATION_CACHE_TTL < now:
+        metrics.increment('recommendation_cache_requests_total', result='miss')
+        return None
+    metrics.increment('recommendation_cache_requests_total', result='hit')
+    entry.hits += 1
+    entry.last_used_at = now
+    db.session.commit()
+    return entry.recommendations
+
+
+def store_recommendations(movie_choices, genres, recommendations):
+    key = cache_key(movie_choices, genres)
+    now = datetime.utcnow()
+    try:
+        entry = db.session.get(RecommendationCache, key) or RecommendationCache(key=key, hits=0)
+        entry.recommendations = recommendations
+        entry.created_at = entry.last_used_at = now
+        db.session.add(entry)
+        db.session.commit()
+        if random.random() < EVICTION_PROBABILITY:
+            evict_recommendations(now)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(f"Unable to cache recommendations: {e}")
+
+
+def evict_recommendations(now):
+    expired = RecommendationCache.query \
+        .filter(RecommendationCache.created_at < now - RECOMMENDATION_CACHE_TTL) \
+        .delete(synchronize_session=False)
+    # Everything used before the newest RECOMMENDATION_CACHE_MAX_ENTRIES goes,
+    # found with one read off the last_used_at index
+    cutoff = db.session.query(RecommendationCache.last_used_at) \
+        .order_by(RecommendationCache.last_used_at.desc()) \
+        .offset(RECOMMENDATION_CACHE_MAX_ENTRIES - 1) \
+        .limit(1) \
+        .scalar()
+    overflow = 0
+    if cutoff is not None:
+        overflow = RecommendationCache.query \
+            .filter(RecommendationCache.last_used_at < cutoff) \
+            .delete(synchronize_session=False)
+    db.session.commit()
+    if expired or overflow:
+        metrics.increment('recommendation_cache_evictions_total', expired + overflow)
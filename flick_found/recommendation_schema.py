@@ -0,0 +1,59 @@
+from typing import Annotated, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, WrapValidator, field_validator
+
+
+# Validates the compact replies asked for by recommender.py:
+#
+#     {"m": [{"t": "Heat", "g": "Crime, Thriller", "r": 8.3, "d": "1995-12-15"}, ...]}
+#
+# pydantic is slow to import, so this module is loaded with the first reply.
+
+
+class CompactRecommendation(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    t: str = Field(min_length=1, max_length=120)
+    g: str = Field(min_length=1, max_length=100)
+    r: float = Field(ge=0, le=10)
+    d: str = Field(pattern=r'^\d{4}(-\d{2}(-\d{2})?)?$')
+
+    @field_validator('r', mode='before')
+    @classmethod
+    def _rating_number(cls, value):
+        # Models sometimes answer "8.1/10"
+        if isinstance(value, str):
+            return value.split('/')[0].strip()
+        return value
+
+    def to_recommendation(self):
+        return {'title': self.t, 'genre': self.g, 'rating': self.r, 'release_date': self.d}
+
+
+def _drop_invalid(value, handler):
+    # An invalid item becomes None instead of failing the whole reply
+    try:
+        return handler(value)
+    except ValidationError:
+        return None
+
+
+class CompactResponse(BaseModel):
+    m: list[Annotated[Optional[CompactRecommendation], WrapValidator(_drop_invalid)]]
+
+
+def parse_response(text):
+    # Parses and validates a whole reply in one pass. Returns the valid
+    # recommendations and how many items were dropped. Raises
+    # ValidationError when the reply isn't the expected object at all.
+    items = CompactResponse.model_validate_json(text).m
+    recommendations = [item.to_recommendation() for item in items if item is not None]
+    return recommendations, len(items) - len(recommendations)
+
+
+def parse_item(text):
+    # One streamed item, or None when it is invalid
+    try:
+        return CompactRecommendation.model_validate_json(text).to_recommendation()
+    except ValidationError:
+        return None
@@ -0,0 +1,266 @@
+import os
+from datetime import datetime
+
+import metrics
+from enrichment import enqueue as enqueue_enrichment
+from instrumentation import span, timed
+from llm import InvalidResponse, LLMUnavailable, call_with_retry, get_client
+from genres import genre_mask
+from models import db, normalize_title, upsert, RecommendedMovies
+from page_cache import recommendations_changed
+
+
+OPENAI_MODEL = os.environ.get('OPENAI_MODEL', 'gpt-3.5-turbo')
+RECOMMENDATION_COUNT = 30
+# Most a single /generate may ask for
+MAX_RECOMMENDATION_COUNT = int(os.environ.get('MAX_RECOMMENDATION_COUNT', 50))
+# Completion budget per recommendation; a compact item is about 25 tokens
+TOKENS_PER_RECOMMENDATION = int(os.environ.get('OPENAI_TOKENS_PER_RECOMMENDATION', 40))
+# The reply format: short keys, validated by recommendation_schema.py
+RESPONSE_FORMAT_EXAMPLE = '{"m":[{"t":"Title","g":"Genre, Genre","r":7.9,"d":"YYYY-MM-DD"}]}'
+# While streaming, the first recommendation is saved on its own so it shows
+# up quickly, then the rest are saved in batches of this size
+STREAM_BATCH_SIZE = 5
+
+
+def recommendation_messages(movie_choices, preferences, count=RECOMMENDATION_COUNT, exclude=()):
+    # Kept short: the instructions are sent with every call, and the compact
+    # keys keep the reply, which is most of the latency, small
+    messages = [
+        {"role": "system", "content": "You are a movie recommendation bot. Reply with JSON only, in this form: "
+                                      f"{RESPONSE_FORMAT_EXAMPLE}. m holds {count} movies: t is the title, "
+                                      "g the genres, r the IMDB rating out of 10 and d the release date."},
+        {"role": "user", "content": f"Movies: {'; '.join(movie_choices)}\nGenres: {', '.join(preferences)}"}
+    ]
+    if exclude:
+        messages.append({"role": "user", "content": "Do not include any of these movies: " + ", ".join(exclude)})
+    return messages
+
+
+def max_tokens(count):
+    return TOKENS_PER_RECOMMENDATION * count + 20
+
+
+def record_usage(usage):
+    if usage is not None:
+        metrics.increment('llm_tokens_total', usage.prompt_tokens, kind='prompt')
+        metrics.increment('llm_tokens_total', usage.completion_tokens, kind='completion')
+
+
+@timed('openai.generate_recommendations')
+def generate_recommendations(movie_choices, preferences, timeout=None, count=RECOMMENDATION_COUNT):
+    # Returns the valid recommendations in the reply; invalid items are dropped
+    from recommendation_schema import ValidationError, parse_response
+    print("\nProcessing request....")
+    completion = get_client().chat.completions.create(
+        model=OPENAI_MODEL,
+        messages=recommendation_messages(movie_choices, preferences, count),
+        response_format={"type": "json_object"},
+        max_tokens=max_tokens(count),
+        timeout=timeout
+    )
+    record_usage(completion.usage)
+    try:
+        recommendations, dropped = parse_response(completion.choices[0].message.content)
+    except ValidationError as e:
+        print("The response was not in the recommendation format")
+        raise InvalidResponse('Response was not valid recommendation JSON') from e
+    metrics.increment('recommendation_items_total', len(recommendations), result='valid')
+    if dropped:
+        print(f"Dropped {dropped} invalid recommendations")
+        metrics.increment('recommendation_items_total', dropped, result='dropped')
+    if not recommendations:
+        raise InvalidResponse('Response held no valid recommendations')
+    return recommendations
+
+
+# The verbose {"recommendations": [{"title": ...}]} reply format used
+# before the compact one
+def process_item(item):
+    return {
+        'title': item['title'],
+        'genre': item['genre'],
+        'rating': item['rating'],
+        'release_date': item['release_date']
+    }
+
+
+def process_response(response):
+    recommendations = response['recommendations']
+    processed_recommendations = []
+    for item in recommendations:
+        processed_recommendations.append(process_item(item))
+    return processed_recommendations
+
+
+def rating_number(value):
+    # Ratings are numbers in the compact format, but the LLM's text ("8.1",
+    # "8.1/10") in the verbose one; None when there is no number
+    try:
+        return float(str(value).split('/')[0])
+    except ValueError:
+        return None
+
+
+def is_valid_recommendation(recommendation):
+    return (all(recommendation.get(key) for key in ('title', 'genre', 'release_date'))
+            and rating_number(recommendation.get('rating')) is not None)
+
+
+def process_choices_and_recommendations(movie_choices, recommendations, count=RECOMMENDATION_COUNT):
+    def attempt(timeout):
+        return generate_recommendations(movie_choices, recommendations, timeout, count)
+
+    try:
+        return call_with_retry(attempt)
+    except LLMUnavailable as e:
+        print(f'Unable to get recommendations: {e}')
+        return ''
+
+
+def modify_database(recommendations, user_id):
+    # Saves the valid recommendations the user doesn't already have. Returns
+    # how many rows were added.
+    rows = {}
+    # The rows are queued for enrichment below, so they are claimed for it
+    # from the start and other workers leave them alone
+    now = datetime.utcnow()
+    for recommendation in recommendations:
+        if is_valid_recommendation(recommendation):
+            title_key = normalize_title(recommendation['title'])
+            rows[title_key] = {
+                'user_id': user_id,
+                'title': recommendation['title'],
+                'title_key': title_key,
+                'genre': recommendation['genre'],
+                'genre_mask': genre_mask(recommendation['genre']),
+                'rating': rating_number(recommendation['rating']),
+                'release_date': recommendation['release_date'],
+                'enrichment_claimed_at': now
+            }
+        else:
+            print(f"Skipping invalid recommendation: {recommendation}")
+
+    try:
+        # One statement for the whole batch; a movie recommended to the
+        # same user again keeps its existing row, whose TMDB details are
+        # better than what the LLM gave this time
+        added = upsert(RecommendedMovies, list(rows.values()), ['user_id', 'title_key'])
+        db.session.commit()
+        recommendations_changed(user_id)
+        # TMDB details are filled in in the background
+        enqueue_enrichment(user_id, rows)
+        print('Movies successfully added')
+        return added
+    except Exception as e:
+        db.session.rollback()
+        print(f"An error occurred: {e}")
+        return 0
+
+
+class RecommendationStreamParser:
+    # Incrementally scans the streamed {"m": [{...}, ...]} reply and hands
+    # back each recommendation object as soon as its closing brace arrives,
+    # without waiting for (or needing) the rest of the reply.
+
+    def __init__(self):
+        self.invalid = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._item = None
+
+    def feed(self, text):
+        items = []
+        for char in text:
+            if self._item is not None:
+                self._item.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                # Objects two levels down are the recommendations themselves
+                if char == '{' and self._depth == 2:
+                    self._item = [char]
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if char == '}' and self._depth == 2 and self._item is not None:
+                    item = self._parse(''.join(self._item))
+                    if item is not None:
+                        items.append(item)
+                    self._item = None
+        return items
+
+    def _parse(self, text):
+        from recommendation_schema import parse_item
+        item = parse_item(text)
+        if item is None:
+            print(f"Skipping invalid recommendation: {text}")
+            self.invalid += 1
+            metrics.increment('recommendation_items_total', result='dropped')
+            return None
+        metrics.increment('recommendation_items_total', result='valid')
+        return item
+
+
+def stream_recommendations(movie_choices, preferences, count, exclude=(), timeout=None):
+    stream = get_client().chat.completions.create(
+        model=OPENAI_MODEL,
+        messages=recommendation_messages(movie_choices, preferences, count, exclude),
+        response_format={"type": "json_object"},
+        max_tokens=max_tokens(count),
+        stream=True,
+        # The last chunk carries the token counts for the whole reply
+        stream_options={"include_usage": True},
+        timeout=timeout
+    )
+    parser = RecommendationStreamParser()
+    # Times the whole stream, including the time spent saving each batch
+    with span('openai.stream_recommendations'):
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield from parser.feed(chunk.choices[0].delta.content)
+            record_usage(chunk.usage)
+
+
+def generate_recommendations_streaming(movie_choices, preferences, save_batch, count=RECOMMENDATION_COUNT):
+    # Streams recommendations into save_batch() as they are parsed. When some
+    # items are malformed, missing or duplicated, only that many are asked for
+    # again. Returns how many recommendations were saved.
+    seen_titles = {}
+
+    def attempt(timeout):
+        batch = []
+        try:
+            for item in stream_recommendations(movie_choices, preferences, count - len(seen_titles),
+                                               list(seen_titles.values()), timeout):
+                key = item['title'].strip().lower()
+                if key in seen_titles:
+                    continue
+                seen_titles[key] = item['title']
+                batch.append(item)
+                if len(batch) >= (1 if len(seen_titles) == 1 else STREAM_BATCH_SIZE):
+                    save_batch(batch)
+                    batch = []
+                if len(seen_titles) >= count:
+                    break
+        finally:
+            # Keep what was parsed even if the stream broke off part way
+            if batch:
+                save_batch(batch)
+        missing = count - len(seen_titles)
+        if missing > 0:
+            raise InvalidResponse(f'{missing} recommendations were missing or invalid')
+
+    try:
+        call_with_retry(attempt)
+    except LLMUnavailable as e:
+        print(f'Unable to get all recommendations: {e}')
+    return len(seen_titles)
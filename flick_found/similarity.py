@@ -0,0 +1,131 @@
+import os
+import re
+import threading
+import time
+from datetime import date
+
+import numpy as np
+
+from genres import GENRES, genre_mask
+from models import db, normalize_title, RecommendedMovies
+from upcoming import upcoming_feed
+
+
+# Similar movies /generate saves straight away; OpenAI is only asked for the rest
+LOCAL_RECOMMENDATIONS = int(os.environ.get('LOCAL_RECOMMENDATIONS', 10))
+# How often the in-process index is rebuilt from the database and feed
+SIMILARITY_REBUILD_SECONDS = int(os.environ.get('SIMILARITY_REBUILD_SECONDS', 900))
+# Most stored recommendations (newest first) that go into the index
+SIMILARITY_MAX_MOVIES = int(os.environ.get('SIMILARITY_MAX_MOVIES', 50000))
+# How much rating and release year count next to a single shared genre
+RATING_WEIGHT = 0.5
+YEAR_WEIGHT = 0.5
+
+GENRE_BITS = len(GENRES)
+FEATURES = GENRE_BITS + 2
+
+
+def genre_bits(masks):
+    # One row of 0/1 genre columns per genre mask
+    return (np.asarray(masks, dtype=np.int64)[:, None] >> np.arange(GENRE_BITS)) & 1
+
+
+def _number(value, pattern=r'\d+(\.\d+)?'):
+    match = re.search(pattern, str(value))
+    return float(match.group()) if match else np.nan
+
+
+def feature_matrix(movies):
+    matrix = np.zeros((len(movies), FEATURES), dtype=np.float32)
+    if not movies:
+        return matrix
+    matrix[:, :GENRE_BITS] = genre_bits([movie['genre_mask'] for movie in movies])
+    ratings = np.array([_number(movie['rating']) for movie in movies], dtype=np.float32)
+    years = np.array([_number(movie['release_date'], r'(19|20)\d\d') for movie in movies], dtype=np.float32)
+    matrix[:, -2] = np.nan_to_num(RATING_WEIGHT * np.minimum(ratings, 10) / 10)
+    matrix[:, -1] = np.nan_to_num(YEAR_WEIGHT * (years - 1900) / 130)
+    return matrix
+
+
+class SimilarityIndex:
+    def __init__(self, movies):
+        self.movies = movies
+        self.keys = [normalize_title(movie['title']) for movie in movies]
+        self.positions = {key: i for i, key in enumerate(self.keys)}
+        matrix = feature_matrix(movies)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        # Rows are unit length, so a dot product with a unit query is the cosine
+        self.matrix = matrix / np.where(norms == 0, 1, norms)
+
+    def query_vector(self, movie_choices, genres):
+        # Mean of the seed movies we know about, plus the preferred genres
+        vector = np.zeros(FEATURES, dtype=np.float32)
+        seeds = [self.positions[key] for key in map(normalize_title, movie_choices) if key in self.positions]
+        if seeds:
+            vector += self.matrix[seeds].mean(axis=0)
+        if genres:
+            vector[:GENRE_BITS] += genre_bits([genre_mask(genre) for genre in genres]).sum(axis=0)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def top_k(self, query, k, exclude=()):
+        if not len(self.movies) or k <= 0 or not query.any():
+            return []
+        scores = self.matrix @ query
+        excluded = [self.positions[key] for key in exclude if key in self.positions]
+        scores[excluded] = -np.inf
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [self.movies[i] for i in best if np.isfinite(scores[i]) and scores[i] > 0]
+
+
+def build_index():
+    rows = db.session.query(RecommendedMovies.title, RecommendedMovies.genre, RecommendedMovies.genre_mask,
+                            RecommendedMovies.rating, RecommendedMovies.release_date) \
+        .order_by(RecommendedMovies.id.desc()) \
+        .limit(SIMILARITY_MAX_MOVIES) \
+        .all()
+    movies = {}
+    # Feed movies that are out and rated; the rest aren't "similar movies"
+    # yet, and couldn't be saved as recommendations anyway
+    today = date.today().isoformat()
+    for movie in upcoming_feed.snapshot().movies:
+        if movie['rating'] and movie['release_date'] and movie['release_date'] <= today:
+            movies.setdefault(normalize_title(movie['title']), movie)
+    for title, genre, mask, rating, release_date in rows:
+        movies.setdefault(normalize_title(title), {
+            'title': title, 'genre': genre, 'genre_mask': mask, 'rating': rating, 'release_date': release_date
+        })
+    return SimilarityIndex(list(movies.values()))
+
+
+_index = None
+_built_at = 0
+_build_lock = threading.Lock()
+
+
+def get_index():
+    global _index, _built_at
+    if _index is None or time.monotonic() - _built_at >= SIMILARITY_REBUILD_SECONDS:
+        # Only one thread rebuilds; the rest keep using the previous index
+        if _build_lock.acquire(blocking=_index is None):
+            try:
+                if _index is None or time.monotonic() - _built_at >= SIMILARITY_REBUILD_SECONDS:
+                    _index = build_index()
+                    _built_at = time.monotonic()
+            finally:
+                _build_lock.release()
+    return _index
+
+
+def recommend_similar(user_id, movie_choices, genres, k):
+    # Up to k stored or upcoming movies most similar to the seeds, leaving
+    # out the seeds and anything already recommended to the user
+    if k <= 0:
+        return []
+    index = get_index()
+    exclude = {normalize_title(movie) for movie in movie_choices}
+    exclude.update(key for (key,) in db.session.query(RecommendedMovies.title_key).filter_by(user_id=user_id))
+    movies = index.top_k(index.query_vector(movie_choices, genres), k, exclude)
+    return [{key: movie[key] for key in ('title', 'genre', 'rating', 'release_date')} for movie in movies]
@@ -0,0 +1,83 @@
+import unittest
+from unittest.mock import patch
+
+import calendar_client
+import enrichment
+import jobs
+from app import create_app, recommendation_page
+from genres import genre_mask
+from models import db, RecommendedMovies
+
+
+class TestRecommendationPages(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'TESTING': True})
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        # Ids 1 to 7 for user 1, alternating Action and Drama, and one for user 2
+        for i in range(1, 8):
+            genre = 'Action' if i % 2 else 'Drama'
+            db.session.add(RecommendedMovies(user_id=1, title=f'Movie {i}', title_key=f'movie {i}', genre=genre,
+                                             genre_mask=genre_mask(genre), rating=7.0, release_date='2020-01-01'))
+        db.session.add(RecommendedMovies(user_id=2, title='Other', title_key='other', genre='Action',
+                                         genre_mask=genre_mask('Action'), rating=7.0, release_date='2020-01-01'))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+        # create_app() hands the app to the background pools; later tests
+        # must not have them work on this one's dropped database
+        jobs._app = enrichment._app = calendar_client._app = None
+
+    def titles(self, rows):
+        return [row.title for row in rows]
+
+    def test_pages_follow_the_cursor(self):
+        rows, cursor = recommendation_page(1, 0, limit=3)
+        self.assertEqual(self.titles(rows), ['Movie 7', 'Movie 6', 'Movie 5'])
+        rows, cursor = recommendation_page(1, 0, cursor, limit=3)
+        self.assertEqual(self.titles(rows), ['Movie 4', 'Movie 3', 'Movie 2'])
+        rows, cursor = recommendation_page(1, 0, cursor, limit=3)
+        self.assertEqual(self.titles(rows), ['Movie 1'])
+        self.assertIsNone(cursor)
+
+    def test_last_full_page_has_no_cursor(self):
+        rows, cursor = recommendation_page(1, 0, limit=7)
+        self.assertEqual(len(rows), 7)
+        self.assertIsNone(cursor)
+
+    def test_rows_added_between_pages_are_not_repeated(self):
+        rows, cursor = recommendation_page(1, 0, limit=3)
+        db.session.add(RecommendedMovies(user_id=1, title='Newer', title_key='newer', genre='Drama',
+                                         genre_mask=genre_mask('Drama'), rating=7.0, release_date='2020-01-01'))
+        db.session.commit()
+        rows, cursor = recommendation_page(1, 0, cursor, limit=3)
+        self.assertEqual(self.titles(rows), ['Movie 4', 'Movie 3', 'Movie 2'])
+
+    def test_genre_filter(self):
+        rows, cursor = recommendation_page(1, genre_mask('Action'), limit=2)
+        self.assertEqual(self.titles(rows), ['Movie 7', 'Movie 5'])
+        rows, cursor = recommendation_page(1, genre_mask('Action'), cursor, limit=2)
+        self.assertEqual(self.titles(rows), ['Movie 3', 'Movie 1'])
+        self.assertIsNone(cursor)
+
+    # The first request would otherwise start enriching the rows from TMDB
+    @patch('enrichment.enqueue')
+    def test_api(self, enqueue):
+        client = self.app.test_client()
+        with client.session_transaction() as flask_session:
+            flask_session['user_id'] = 1
+        page = client.get('/api/recommendations?limit=4').get_json()
+        self.assertEqual([rec['title'] for rec in page['recommendations']],
+                         ['Movie 7', 'Movie 6', 'Movie 5', 'Movie 4'])
+        page = client.get(page['next_url']).get_json()
+        self.assertEqual([rec['title'] for rec in page['recommendations']], ['Movie 3', 'Movie 2', 'Movie 1'])
+        self.assertIsNone(page['next'])
+
+
+if __name__ == '__main__':
+    unittest.main()
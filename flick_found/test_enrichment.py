@@ -0,0 +1,64 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import enrichment
+from enrichment import ENRICH_CLAIM_TIMEOUT, resume_pending
+from models import db, RecommendedMovies
+from tests import create_test_app
+
+
+class TestResumePending(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+        enqueue = patch('enrichment.enqueue')
+        self.enqueue = enqueue.start()
+        self.addCleanup(enqueue.stop)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def add(self, title, claimed_at=None, enriched_at=None, user_id=1):
+        db.session.add(RecommendedMovies(user_id=user_id, title=title, title_key=title.lower(), genre='Drama',
+                                         genre_mask=0, rating=7.0, release_date='2020-01-01',
+                                         enrichment_claimed_at=claimed_at, enriched_at=enriched_at))
+        db.session.commit()
+
+    def queued(self):
+        return {user_id: sorted(keys) for (user_id, keys), _ in self.enqueue.call_args_list}
+
+    def test_claims_unclaimed_and_abandoned_rows(self):
+        now = datetime.utcnow()
+        self.add('Unclaimed')
+        self.add('Abandoned', claimed_at=now - ENRICH_CLAIM_TIMEOUT - timedelta(minutes=1))
+        self.add('Queued', claimed_at=now)
+        self.add('Enriched', enriched_at=now)
+        self.add('Other', user_id=2)
+        self.assertEqual(resume_pending(), 3)
+        self.assertEqual(self.queued(), {1: ['abandoned', 'unclaimed'], 2: ['other']})
+
+    def test_rows_are_claimed_once(self):
+        self.add('Unclaimed')
+        self.assertEqual(resume_pending(), 1)
+        # Another worker's sweep finds nothing left to take
+        self.assertEqual(resume_pending(), 0)
+        self.assertEqual(self.enqueue.call_count, 1)
+
+    def test_claims_a_page_at_a_time(self):
+        for i in range(5):
+            self.add(f'Movie {i}')
+        with patch.object(enrichment, 'ENRICH_RESUME_PAGE', 2):
+            self.assertEqual(resume_pending(), 2)
+            self.assertEqual(self.queued(), {1: ['movie 0', 'movie 1']})
+            self.assertEqual(resume_pending(), 2)
+            self.assertEqual(resume_pending(), 1)
+            self.assertEqual(resume_pending(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
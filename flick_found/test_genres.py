@@ -0,0 +1,44 @@
+import unittest
+
+from genres import ALL_GENRES_MASK, genre_mask, genre_mask_from_ids, genre_names
+
+
+def names(text):
+    return set(genre_names(genre_mask(text)))
+
+
+class TestGenreMask(unittest.TestCase):
+
+    def test_lists(self):
+        self.assertEqual(names('Action, Sci-Fi'), {'action', 'scifi'})
+        self.assertEqual(names('Horror / Mystery & Thriller'), {'horror', 'mystery', 'thriller'})
+        self.assertEqual(names('Crime and Drama'), {'crime', 'drama'})
+
+    def test_spellings(self):
+        self.assertEqual(names('SCIENCE FICTION'), {'scifi'})
+        self.assertEqual(names('sci fi'), {'scifi'})
+        self.assertEqual(names('Comedies'), {'comedy'})
+        self.assertEqual(names('Romantic Comedy'), {'romance', 'comedy'})
+        self.assertEqual(names('RomCom'), {'romance', 'comedy'})
+
+    def test_genres_written_together(self):
+        self.assertEqual(names('Crime Drama'), {'crime', 'drama'})
+        self.assertEqual(names('Sci-Fi Thriller'), {'scifi', 'thriller'})
+        self.assertEqual(names('Comedy-Drama'), {'comedy', 'drama'})
+        self.assertEqual(names('Science Fiction Horror'), {'scifi', 'horror'})
+
+    def test_unknown(self):
+        self.assertEqual(genre_mask('Mumblecore'), 0)
+        self.assertEqual(genre_mask(''), 0)
+        self.assertEqual(genre_mask(None), 0)
+
+    def test_from_ids(self):
+        self.assertEqual(genre_mask_from_ids([28, 878]), genre_mask('Action, Sci-Fi'))
+        self.assertEqual(genre_mask_from_ids([12345]), 0)
+
+    def test_every_genre_has_its_own_bit(self):
+        self.assertEqual(len(genre_names(ALL_GENRES_MASK)), bin(ALL_GENRES_MASK).count('1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
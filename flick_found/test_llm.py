@@ -0,0 +1,88 @@
+import unittest
+from unittest.mock import Mock, patch
+
+import llm
+from llm import CircuitBreaker, LLMUnavailable, call_with_retry
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        clock = patch('llm.time.monotonic', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30)
+
+    def open_breaker(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+
+    def test_opens_after_threshold_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertFalse(self.breaker.allow())
+
+    def test_success_resets_the_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_half_open_lets_one_trial_through(self):
+        self.open_breaker()
+        self.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.now += 1
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, 'half_open')
+        self.assertFalse(self.breaker.allow())
+
+    def test_trial_success_closes(self):
+        self.open_breaker()
+        self.now += 30
+        self.breaker.allow()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertTrue(self.breaker.allow())
+
+    def test_trial_failure_opens_again(self):
+        self.open_breaker()
+        self.now += 30
+        self.breaker.allow()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        self.now += 29
+        self.assertFalse(self.breaker.allow())
+
+    def test_calls_fail_fast_while_open(self):
+        self.open_breaker()
+        operation = Mock()
+        with patch.object(llm, 'breaker', self.breaker):
+            with self.assertRaises(LLMUnavailable):
+                call_with_retry(operation)
+        operation.assert_not_called()
+
+    def test_rate_limited_trial_is_released(self):
+        self.open_breaker()
+        self.now += 30
+        operation = Mock(return_value='ok')
+        with patch.object(llm, 'breaker', self.breaker):
+            with patch('llm.acquire', side_effect=llm.RateLimited('openai', 1)):
+                with self.assertRaises(LLMUnavailable):
+                    call_with_retry(operation)
+            self.assertEqual(self.breaker.state, 'open')
+            # The next call makes the trial, and closes the breaker
+            with patch('llm.acquire'):
+                self.assertEqual(call_with_retry(operation), 'ok')
+        self.assertEqual(self.breaker.state, 'closed')
+        operation.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
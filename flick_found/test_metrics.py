@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import metrics
+
+
+class TestSharedMetrics(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        for patcher in (patch.object(metrics, 'METRICS_DIR', directory.name),
+                        patch.object(metrics, '_counters', {}),
+                        patch.object(metrics, '_gauges', {}),
+                        patch.object(metrics, '_histograms', {})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def other_process(self, pid, counter, gauge):
+        # Another worker's file, as it would have written it
+        data = metrics._empty()
+        data['counters'][('test_total', (('kind', 'a'),))] = counter
+        data['gauges'][('test_open', ())] = gauge
+        data['histograms'][('test_seconds', ())] = {'buckets': [1, 2], 'sum': 0.5, 'count': 2}
+        metrics._write(os.path.join(self.directory, f'{pid}.json'), data)
+
+    def test_adds_up_every_process(self):
+        metrics.increment('test_total', 2, kind='a')
+        metrics.set_gauge('test_open', 0)
+        self.other_process(os.getppid(), 3, 1)
+        data = metrics.collect_all()
+        self.assertEqual(data['counters'][('test_total', (('kind', 'a'),))], 5)
+        self.assertEqual(data['gauges'][('test_open', ())], 1)
+        self.assertIn('test_total{kind="a"} 5', metrics.render_prometheus())
+
+    def test_exited_processes_keep_their_counts(self):
+        metrics.increment('test_total', 2, kind='a')
+        self.other_process(999999999, 3, 1)
+        data = metrics.collect_all()
+        self.assertEqual(data['counters'][('test_total', (('kind', 'a'),))], 5)
+        self.assertEqual(data['histograms'][('test_seconds', ())]['count'], 2)
+        # An exited process's gauge no longer means anything
+        self.assertNotIn(('test_open', ()), data['gauges'])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, '999999999.json')))
+        # Folded in once, not again on the next scrape
+        self.assertEqual(metrics.collect_all()['counters'][('test_total', (('kind', 'a'),))], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+from models import db, normalize_title, upsert, GenrePreferences, RecommendedMovies
+from tests import create_test_app
+
+
+def movie(title, rating=7.0, user_id=1):
+    return {'user_id': user_id, 'title': title, 'title_key': normalize_title(title), 'genre': 'Drama',
+            'genre_mask': 0, 'rating': rating, 'release_date': '2020-01-01'}
+
+
+class TestUpsert(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_inserts_every_row(self):
+        self.assertEqual(upsert(RecommendedMovies, [movie('Heat'), movie('Alien')], ['user_id', 'title_key']), 2)
+        db.session.commit()
+        self.assertEqual(RecommendedMovies.query.count(), 2)
+
+    def test_no_rows(self):
+        self.assertEqual(upsert(RecommendedMovies, [], ['user_id', 'title_key']), 0)
+
+    def test_conflicting_rows_are_skipped(self):
+        upsert(RecommendedMovies, [movie('Heat', 8.3)], ['user_id', 'title_key'])
+        db.session.commit()
+        added = upsert(RecommendedMovies, [movie(' heat ', 5.0), movie('Alien'), movie('Heat', user_id=2)],
+                       ['user_id', 'title_key'])
+        db.session.commit()
+        self.assertEqual(added, 2)
+        heat = RecommendedMovies.query.filter_by(user_id=1, title_key='heat').one()
+        # The existing row is kept as it was
+        self.assertEqual((heat.title, heat.rating), ('Heat', 8.3))
+        self.assertEqual(RecommendedMovies.query.count(), 3)
+
+    def test_conflicting_rows_update_columns(self):
+        upsert(GenrePreferences, [{'user_id': 1, 'genre': 'drama', 'genre_mask': 0}], ['user_id', 'genre'])
+        db.session.commit()
+        upsert(GenrePreferences, [{'user_id': 1, 'genre': 'drama', 'genre_mask': 64},
+                                  {'user_id': 1, 'genre': 'crime', 'genre_mask': 16}],
+               ['user_id', 'genre'], ['genre_mask'])
+        db.session.commit()
+        masks = {row.genre: row.genre_mask for row in GenrePreferences.query.all()}
+        self.assertEqual(masks, {'drama': 64, 'crime': 16})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+from werkzeug.security import generate_password_hash
+
+import calendar_client
+import enrichment
+import jobs
+import password_hashing
+from app import create_app
+from models import db, User
+from password_hashing import CURRENT_METHOD, needs_rehash
+
+
+class TestLogin(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'TESTING': True, 'WTF_CSRF_ENABLED': False})
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        # Attempts are limited through the rate limiter's shared file
+        admit = patch('app.admit_login', return_value=True)
+        admit.start()
+        self.addCleanup(admit.stop)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+        jobs._app = enrichment._app = calendar_client._app = None
+
+    def add_user(self, password_hash):
+        db.session.add(User(email='a@example.com', password=password_hash))
+        db.session.commit()
+
+    def login(self, password='secret'):
+        return self.client.post('/login', data={'email': 'a@example.com', 'password': password})
+
+    def test_older_hash_is_replaced_on_login(self):
+        old_hash = generate_password_hash('secret', 'pbkdf2:sha256:1000')
+        self.assertTrue(needs_rehash(old_hash))
+        self.add_user(old_hash)
+        response = self.login()
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn('/login', response.location)
+        db.session.expire_all()
+        new_hash = User.query.one().password
+        self.assertTrue(new_hash.startswith(CURRENT_METHOD + '$'))
+        self.assertFalse(needs_rehash(new_hash))
+        # The new hash still takes the same password
+        self.client.get('/logout')
+        self.assertNotIn('/login', self.login().location)
+
+    def test_wrong_password_keeps_the_older_hash(self):
+        old_hash = generate_password_hash('secret', 'pbkdf2:sha256:1000')
+        self.add_user(old_hash)
+        self.assertIn('/login', self.login('wrong').location)
+        db.session.expire_all()
+        self.assertEqual(User.query.one().password, old_hash)
+
+    def test_busy_when_every_slot_is_taken(self):
+        self.add_user(generate_password_hash('secret', CURRENT_METHOD))
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        with patch.object(password_hashing, '_slots', slots):
+            self.assertEqual(self.login().status_code, 503)
+        slots.release()
+        self.assertEqual(self.login().status_code, 302)
+
+
+if __name__ == '__main__':
+    unittest.main()
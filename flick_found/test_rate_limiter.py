@@ -0,0 +1,97 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import rate_limiter
+from rate_limiter import BACKGROUND, INTERACTIVE, RateLimited, acquire, admit, lane, throttle
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        # Each test gets its own bucket file and a clock it moves by hand
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.now = 1000.0
+        for patcher in (patch.object(rate_limiter, 'RATE_LIMIT_DB', os.path.join(directory.name, 'buckets.db')),
+                        patch.dict(rate_limiter.RATE_LIMITS, {'test': (2.0, 4.0)}),
+                        patch('rate_limiter.time.time', side_effect=lambda: self.now)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.close_connection)
+        self.close_connection()
+
+    def close_connection(self):
+        conn = getattr(rate_limiter._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            rate_limiter._local.conn = None
+
+    def take(self, count):
+        for _ in range(count):
+            acquire('test', timeout=0)
+
+    def test_burst_then_rejected(self):
+        self.take(4)
+        with self.assertRaises(RateLimited) as raised:
+            acquire('test', timeout=0)
+        self.assertAlmostEqual(raised.exception.retry_after, 0.5)
+
+    def test_refills_at_rate(self):
+        self.take(4)
+        self.now += 1
+        self.take(2)
+        with self.assertRaises(RateLimited):
+            acquire('test', timeout=0)
+
+    def test_refills_up_to_burst(self):
+        self.take(1)
+        self.now += 60
+        self.take(4)
+        with self.assertRaises(RateLimited):
+            acquire('test', timeout=0)
+
+    def test_background_leaves_a_reserve(self):
+        with lane(BACKGROUND):
+            self.take(3)
+            with self.assertRaises(RateLimited):
+                acquire('test', timeout=0)
+        # Page loads may still use the reserve
+        self.take(1)
+
+    def test_background_waits_for_interactive_callers(self):
+        rate_limiter._set_waiting('test', INTERACTIVE, 1)
+        with lane(BACKGROUND):
+            with self.assertRaises(RateLimited):
+                acquire('test', timeout=0)
+        rate_limiter._set_waiting('test', INTERACTIVE, -1)
+        with lane(BACKGROUND):
+            self.take(1)
+
+    def test_waiters_from_dead_processes_are_ignored(self):
+        rate_limiter._connection().execute("INSERT INTO waiters (upstream, lane, pid, waiting) "
+                                           "VALUES ('test', ?, 999999999, 1)", (INTERACTIVE,))
+        with lane(BACKGROUND):
+            self.take(1)
+        self.assertEqual(rate_limiter._connection().execute('SELECT COUNT(*) FROM waiters').fetchone()[0], 0)
+
+    def test_throttle_empties_the_bucket(self):
+        throttle('test', 3)
+        self.now += 3
+        with self.assertRaises(RateLimited):
+            acquire('test', timeout=0)
+        self.now += 0.5
+        self.take(1)
+
+    def test_admit_per_key(self):
+        for _ in range(2):
+            self.assertTrue(admit('login', 'a@example.com', rate=1 / 60, burst=2))
+        self.assertFalse(admit('login', 'a@example.com', rate=1 / 60, burst=2))
+        self.assertTrue(admit('login', 'b@example.com', rate=1 / 60, burst=2))
+        self.now += 60
+        self.assertTrue(admit('login', 'a@example.com', rate=1 / 60, burst=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import json
+import unittest
+
+from pydantic import ValidationError
+
+from recommendation_schema import parse_item, parse_response
+
+
+HEAT = {'t': 'Heat', 'g': 'Crime, Thriller', 'r': 8.3, 'd': '1995-12-15'}
+ALIEN = {'t': 'Alien', 'g': 'Horror, Sci-Fi', 'r': 8.5, 'd': '1979-05-25'}
+
+
+class TestParseResponse(unittest.TestCase):
+
+    def test_valid_reply(self):
+        recommendations, dropped = parse_response(json.dumps({'m': [HEAT, ALIEN]}))
+        self.assertEqual(recommendations[0], {'title': 'Heat', 'genre': 'Crime, Thriller', 'rating': 8.3,
+                                              'release_date': '1995-12-15'})
+        self.assertEqual([movie['title'] for movie in recommendations], ['Heat', 'Alien'])
+        self.assertEqual(dropped, 0)
+
+    def test_invalid_items_are_dropped_and_counted(self):
+        items = [dict(HEAT, r=11), ALIEN, {'t': 'No Genre'}, dict(HEAT, d='soon'), 'Heat', None]
+        recommendations, dropped = parse_response(json.dumps({'m': items}))
+        self.assertEqual([movie['title'] for movie in recommendations], ['Alien'])
+        self.assertEqual(dropped, 5)
+
+    def test_reply_that_is_not_the_object_fails(self):
+        for text in (json.dumps([HEAT]), json.dumps({'movies': [HEAT]}), json.dumps({'m': 'Heat'}), 'not json'):
+            with self.assertRaises(ValidationError, msg=text):
+                parse_response(text)
+
+    def test_rating_out_of_ten(self):
+        self.assertEqual(parse_item(json.dumps(dict(HEAT, r='8.1/10')))['rating'], 8.1)
+        self.assertEqual(parse_item(json.dumps(dict(HEAT, r=' 7 / 10 ')))['rating'], 7.0)
+        recommendations, _ = parse_response(json.dumps({'m': [dict(HEAT, r='8.1/10')]}))
+        self.assertEqual(recommendations[0]['rating'], 8.1)
+
+    def test_invalid_item(self):
+        self.assertIsNone(parse_item(json.dumps(dict(HEAT, r='great'))))
+        self.assertIsNone(parse_item('{"t": "Heat"'))
+
+
+if __name__ == '__main__':
+    unittest.main()
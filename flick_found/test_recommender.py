@@ -0,0 +1,63 @@
+import json
+import unittest
+
+from recommender import RecommendationStreamParser
+
+
+HEAT = {'t': 'Heat', 'g': 'Crime, Thriller', 'r': 8.3, 'd': '1995-12-15'}
+ALIEN = {'t': 'Alien', 'g': 'Horror, Sci-Fi', 'r': 8.5, 'd': '1979-05-25'}
+
+
+def reply(*items):
+    return json.dumps({'m': list(items)})
+
+
+class TestRecommendationStreamParser(unittest.TestCase):
+
+    def feed_in_chunks(self, text, size):
+        parser = RecommendationStreamParser()
+        items = []
+        for start in range(0, len(text), size):
+            items.extend(parser.feed(text[start:start + size]))
+        return parser, items
+
+    def test_whole_reply(self):
+        parser = RecommendationStreamParser()
+        items = parser.feed(reply(HEAT, ALIEN))
+        self.assertEqual([item['title'] for item in items], ['Heat', 'Alien'])
+        self.assertEqual(items[0], {'title': 'Heat', 'genre': 'Crime, Thriller', 'rating': 8.3,
+                                    'release_date': '1995-12-15'})
+        self.assertEqual(parser.invalid, 0)
+
+    def test_any_chunk_size(self):
+        text = reply(HEAT, ALIEN)
+        for size in (1, 2, 7, 64):
+            _, items = self.feed_in_chunks(text, size)
+            self.assertEqual([item['title'] for item in items], ['Heat', 'Alien'], size)
+
+    def test_item_returned_when_its_brace_arrives(self):
+        parser = RecommendationStreamParser()
+        text = reply(HEAT, ALIEN)
+        first_end = text.index('}') + 1
+        self.assertEqual([item['title'] for item in parser.feed(text[:first_end])], ['Heat'])
+        self.assertEqual([item['title'] for item in parser.feed(text[first_end:])], ['Alien'])
+
+    def test_braces_and_quotes_inside_strings(self):
+        tricky = dict(HEAT, t='The {Weird} "Movie" [Cut] \\ }')
+        _, items = self.feed_in_chunks(reply(tricky, ALIEN), 3)
+        self.assertEqual([item['title'] for item in items], ['The {Weird} "Movie" [Cut] \\ }', 'Alien'])
+
+    def test_invalid_items_are_counted_and_skipped(self):
+        parser = RecommendationStreamParser()
+        items = parser.feed(reply(dict(HEAT, r=11), {'t': 'No Genre'}, ALIEN))
+        self.assertEqual([item['title'] for item in items], ['Alien'])
+        self.assertEqual(parser.invalid, 2)
+
+    def test_truncated_reply_keeps_finished_items(self):
+        text = reply(HEAT, ALIEN)
+        _, items = self.feed_in_chunks(text[:text.rindex('}') - 5], 4)
+        self.assertEqual([item['title'] for item in items], ['Heat'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+from unittest.mock import patch
+
+from genres import genre_mask
+from upcoming import UpcomingFeed
+
+
+def feed(*titles):
+    return {'results': [{'title': title, 'release_date': '2030-01-01', 'vote_average': 7.5, 'poster_path': '/p.jpg',
+                         'genre_ids': [28, 878]} for title in titles]}
+
+
+class TestUpcomingFeed(unittest.TestCase):
+
+    @patch('upcoming.tmdb_get')
+    def test_version_follows_the_content(self, tmdb_get):
+        # Two workers that fetched the same feed agree on its version, so
+        # either may answer a conditional request for the other's page
+        tmdb_get.return_value = feed('Alpha', 'Beta')
+        first, second = UpcomingFeed().snapshot(), UpcomingFeed().snapshot()
+        self.assertIsNotNone(first.version)
+        self.assertEqual(first.version, second.version)
+        tmdb_get.return_value = feed('Alpha', 'Gamma')
+        self.assertNotEqual(UpcomingFeed().snapshot().version, first.version)
+
+    @patch('upcoming.tmdb_get')
+    def test_match(self, tmdb_get):
+        tmdb_get.return_value = feed('Alpha')
+        upcoming = UpcomingFeed()
+        self.assertEqual([movie['title'] for movie in upcoming.match(genre_mask('Sci-Fi'))], ['Alpha'])
+        self.assertEqual(upcoming.match(genre_mask('Romance')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
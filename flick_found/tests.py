@@ -1,88 +1,91 @@
 import unittest
-from flick_found.app import getUserInput, additionalQuestion
-from flick_found.app import userFeedback, process_response
-from flick_found.app import modify_database
 from unittest.mock import patch
-import openai
-import os
 
-my_api_key = os.getenv('OPENAI_KEY')
-openai.api_key = my_api_key
+from flask import Flask
+
+from models import db, RecommendedMovies
+from recommender import is_valid_recommendation, modify_database, process_response
+
+
+def create_test_app():
+    # A bare app on an in-memory database, without the jobs, enrichment and
+    # calendar set up by create_app()
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
 
 
 class TestMediaRecommendations(unittest.TestCase):
 
-    # GetUserInput
-    def test_getUserInput(self):
-        with patch('builtins.input', side_effect=['Batman', 'S']):
-            choices = getUserInput()
-            self.assertEqual(choices, ['Batman'])
-
-    def test_getError(self):
-        with patch('builtins.input', side_effect=['S', 'Batman', 'S']):
-            choices = getUserInput()
-            self.assertEqual(choices, ['Batman'])
-
-    def test_getSixInputs(self):
-        with patch('builtins.input', side_effect=[
-              'Superman', 'Batman', 'Spiderman', 'Hulk',
-              'Wonder Woman', 'Green Lantern']):
-            choices = getUserInput()
-            self.assertEqual(choices, ['Superman', 'Batman',
-                                       'Spiderman', 'Hulk', 'Wonder Woman'])
-
-    # additionalQuestion
-    @patch('builtins.input', side_effect=['Sci-Fi'])
-    def test_additionalQuestion(self, mock_input):
-        preferences = additionalQuestion()
-        self.assertEqual(preferences, 'Sci-Fi')
-
-    @patch('builtins.input', side_effect=[''])
-    def test_additionalQuestion(self, mock_input):
-        preferences = additionalQuestion()
-        self.assertEqual(preferences, '')
-
-    # userFeedback
-    @patch('builtins.input', side_effect=[''])
-    def test_userFeedback_positive(self, x):
-        feedback = userFeedback()
-        self.assertEqual(feedback, '')
-
-    @patch('builtins.input', side_effect=['Some feedback'])
-    def test_userFeedback_negative(self, x):
-        feedback = userFeedback()
-        self.assertEqual(feedback, 'Some feedback')
-
-    @patch('builtins.input', side_effect=[''])
-    def test_userFeedback_negative(self, x):
-        feedback = userFeedback()
-        self.assertEqual(feedback, '')
+    def setUp(self):
+        # Saved rows would otherwise be queued for enrichment, from TMDB,
+        # if another test's create_app() set up the enrichment pool
+        enqueue = patch('recommender.enqueue_enrichment')
+        enqueue.start()
+        self.addCleanup(enqueue.stop)
+        self.app = create_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
 
     # process_response
     def test_process_response(self):
         formatted_data = {'recommendations': [{
-             'title': 'Movie1',
-             'genre': 'Action',
-             'rating': 8.5,
-             'release date': '2020-01-01'
-             }
-          ]
-        }
+            'title': 'Movie1',
+            'genre': 'Action',
+            'rating': 8.5,
+            'release_date': '2020-01-01'
+        }]}
         recommendations = process_response(formatted_data)
         self.assertEqual(len(recommendations), 1)
         self.assertEqual(recommendations[0]['title'], 'Movie1')
 
+    # is_valid_recommendation
+    def test_is_valid_recommendation(self):
+        movie = {'title': 'Movie1', 'genre': 'Action', 'rating': 8.5, 'release_date': '2020-01-01'}
+        self.assertTrue(is_valid_recommendation(movie))
+        self.assertFalse(is_valid_recommendation(dict(movie, rating=None)))
+        self.assertFalse(is_valid_recommendation({'title': 'Movie1'}))
+
     # modify_database
-    @patch('pandas.DataFrame.to_sql')
-    def test_modify_database(self, MockDataFrame):
-        recommendations = [{
-            'title': 'Movie1',
-            'genre': 'Action', 'rating': 8.5,
-            'releaseDate': '2020-01-01'
-            }
+    def test_modify_database(self):
+        recommendations = [
+            {'title': 'Movie1', 'genre': 'Action', 'rating': 8.5, 'release_date': '2020-01-01'},
+            {'title': 'Movie2', 'genre': 'Drama', 'rating': 7.0, 'release_date': '2021-01-01'}
+        ]
+        self.assertEqual(modify_database(recommendations, 1), 2)
+        self.assertEqual(RecommendedMovies.query.filter_by(user_id=1).count(), 2)
+
+    def test_modify_database_skips_invalid(self):
+        recommendations = [
+            {'title': 'Movie1', 'genre': 'Action', 'rating': 8.5, 'release_date': '2020-01-01'},
+            {'title': 'Movie2', 'genre': '', 'rating': 7.0, 'release_date': '2021-01-01'}
         ]
-        modify_database(recommendations)
-        MockDataFrame.assert_called_once()
+        self.assertEqual(modify_database(recommendations, 1), 1)
+        self.assertEqual([movie.title for movie in RecommendedMovies.query.all()], ['Movie1'])
+
+    def test_modify_database_stores_ratings_as_numbers(self):
+        recommendations = [
+            {'title': 'Movie1', 'genre': 'Action', 'rating': '8.1/10', 'release_date': '2020-01-01'},
+            {'title': 'Movie2', 'genre': 'Drama', 'rating': 'unknown', 'release_date': '2021-01-01'}
+        ]
+        self.assertEqual(modify_database(recommendations, 1), 1)
+        self.assertEqual(RecommendedMovies.query.one().rating, 8.1)
+
+    def test_modify_database_counts_only_new_movies(self):
+        movie = {'title': 'Movie1', 'genre': 'Action', 'rating': 8.5, 'release_date': '2020-01-01'}
+        modify_database([movie], 1)
+        # The same title spelled differently is the same movie
+        self.assertEqual(modify_database([dict(movie, title='  movie1 ')], 1), 0)
+        self.assertEqual(modify_database([movie], 2), 1)
+        self.assertEqual(RecommendedMovies.query.count(), 2)
 
 
 if __name__ == '__main__':
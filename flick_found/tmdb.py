@@ -0,0 +1,141 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import timed
+from rate_limiter import BACKGROUND, RateLimited, acquire, current_lane, lane, throttle
+
+
+TMDB_API_KEY = os.environ.get('TMDB_API_KEY')
+TMDB_BASE_URL = os.environ.get('TMDB_BASE_URL', 'https://api.themoviedb.org/3')
+TMDB_IMAGE_BASE_URL = os.environ.get('TMDB_IMAGE_BASE_URL', 'https://image.tmdb.org/t/p/')
+# Image sizes TMDB serves each poster in
+POSTER_SIZES = ('w92', 'w154', 'w185', 'w342', 'w500', 'w780', 'original')
+# Largest poster image we are willing to download
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+
+# Seconds to wait for the TCP connect and for each read from TMDB
+TMDB_TIMEOUT = (3.05, 5)
+# Upper bound on concurrent poster lookups for a single page render
+POSTER_WORKERS = int(os.environ.get('TMDB_POSTER_WORKERS', 8))
+# Longest an API call waits for the shared rate limiter before failing
+TMDB_RATE_WAIT = float(os.environ.get('TMDB_RATE_WAIT', 5))
+# The same for calls in the background lane, which nobody is waiting on and
+# which get fewer tokens while page loads are queued
+TMDB_BACKGROUND_RATE_WAIT = float(os.environ.get('TMDB_BACKGROUND_RATE_WAIT', 60))
+
+_session = None
+_session_lock = threading.Lock()
+_poster_pool = ThreadPoolExecutor(max_workers=POSTER_WORKERS, thread_name_prefix='tmdb-poster')
+
+
+class TMDBError(Exception):
+    # TMDB could not be reached or answered with an error status, which is
+    # kept in status
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def get_session():
+    # requests is imported with the first TMDB call instead of at boot
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                # Keep enough idle keep-alive connections around for every worker thread
+                session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=POSTER_WORKERS))
+                _session = session
+    return _session
+
+
+def tmdb_get(path, **params):
+    # API calls share one rate limit budget across every worker; the image
+    # CDN used by get_image() isn't rate limited
+    import requests
+    params['api_key'] = TMDB_API_KEY
+    try:
+        acquire('tmdb', timeout=TMDB_BACKGROUND_RATE_WAIT if current_lane() == BACKGROUND else TMDB_RATE_WAIT)
+    except RateLimited as e:
+        raise TMDBError(str(e), 429) from e
+    try:
+        response = get_session().get(f'{TMDB_BASE_URL}{path}', params=params, timeout=TMDB_TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        status = getattr(e.response, 'status_code', None)
+        if status == 429:
+            throttle('tmdb', _retry_after(e.response))
+        raise TMDBError(str(e), status) from e
+    return response.json()
+
+
+def _retry_after(response, default=1.0):
+    try:
+        return float(response.headers.get('Retry-After', default))
+    except ValueError:
+        return default
+
+
+def image_url(size, poster_path):
+    return f"{TMDB_IMAGE_BASE_URL}{size}/{poster_path.lstrip('/')}"
+
+
+@timed('tmdb.get_image')
+def get_image(size, poster_path):
+    # Downloads one size of a poster; returns its bytes and content type
+    import requests
+    content = bytearray()
+    try:
+        with get_session().get(image_url(size, poster_path), timeout=TMDB_TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(64 * 1024):
+                content += chunk
+                if len(content) > MAX_IMAGE_BYTES:
+                    raise TMDBError(f'{poster_path} is larger than {MAX_IMAGE_BYTES} bytes')
+    except requests.RequestException as e:
+        raise TMDBError(str(e), getattr(e.response, 'status_code', None)) from e
+    content_type = response.headers.get('Content-Type', '')
+    if not content_type.startswith('image/') or content_type.startswith('image/svg'):
+        raise TMDBError(f'{poster_path} is {content_type or "not an image"}')
+    return bytes(content), content_type
+
+
+# Returned by search_movies() for titles whose lookup failed, as opposed to
+# None for titles TMDB has no match for
+LOOKUP_FAILED = object()
+
+
+@timed('tmdb.search_movie')
+def search_movie(title):
+    data = tmdb_get('/search/movie', query=title)
+    if data['results']:
+        return data['results'][0]
+    return None
+
+
+def _search_or_failed(title):
+    try:
+        return search_movie(title)
+    except (TMDBError, ValueError, KeyError) as e:
+        print(f"Error searching TMDB for {title}: {e}")
+        return LOOKUP_FAILED
+
+
+def search_movies(titles):
+    # Returns one search result per title, in the same order. The searches
+    # run on pool threads but take tokens from the caller's lane.
+    lane_name = current_lane()
+    if lane_name == BACKGROUND:
+        # Background searches may wait a long time for tokens, so they run one
+        # by one in the caller's thread rather than hold pool threads that
+        # page renders need
+        return [_search_or_failed(title) for title in titles]
+
+    def search(title):
+        with lane(lane_name):
+            return _search_or_failed(title)
+
+    return list(_poster_pool.map(search, titles))
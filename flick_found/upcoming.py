@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from instrumentation import span, timed
+from genres import convert_id_to_genre_name, genre_mask_from_ids
+from tmdb import TMDBError, tmdb_get
+
+
+# How often the shared upcoming feed is downloaded again
+UPCOMING_REFRESH_SECONDS = int(os.environ.get('UPCOMING_REFRESH_SECONDS', 3600))
+# How long to wait before retrying after TMDB fails to return the feed
+UPCOMING_RETRY_SECONDS = 60
+
+# movies is the parsed feed in TMDB order, and masks holds the genre mask of
+# each of them so the whole feed is matched with one vectorized AND.
+# fetched_at is the wall-clock time the feed was downloaded. version is a
+# hash of the parsed feed, so every worker that fetched the same feed gives
+# pages showing it the same ETag; it is None until a feed has been fetched.
+FeedSnapshot = namedtuple('FeedSnapshot', ['movies', 'masks', 'version', 'fetched_at'])
+
+
+def _build_snapshot(upcoming_movies_json):
+    movies = []
+    for movie in upcoming_movies_json:
+        movies.append({
+            'title': movie['title'],
+            'release_date': movie['release_date'],
+            'rating': movie['vote_average'],
+            'poster_path': movie['poster_path'],
+            'genre': ', '.join(convert_id_to_genre_name(genre_id) for genre_id in movie['genre_ids']),
+            'genre_mask': genre_mask_from_ids(movie['genre_ids'])
+        })
+    masks = np.array([movie['genre_mask'] for movie in movies], dtype=np.int64)
+    version = hashlib.sha1(json.dumps(movies, sort_keys=True).encode()).hexdigest()
+    return FeedSnapshot(movies, masks, version, time.time())
+
+
+class UpcomingFeed:
+    # Process-wide copy of TMDB's /movie/upcoming feed. Only one thread
+    # refreshes it at a time; while it does, other requests keep serving the
+    # previous copy instead of all calling TMDB at once.
+
+    def __init__(self, refresh_seconds=UPCOMING_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._snapshot = FeedSnapshot([], np.zeros(0, dtype=np.int64), None, 0)
+        self._next_refresh = 0
+        self._refresh_lock = threading.Lock()
+
+    def snapshot(self):
+        if time.monotonic() >= self._next_refresh:
+            # Wait for the refresh only when there is nothing to serve yet
+            if self._refresh_lock.acquire(blocking=self._snapshot.version is None):
+                try:
+                    if time.monotonic() >= self._next_refresh:
+                        self._refresh()
+                finally:
+                    self._refresh_lock.release()
+        return self._snapshot
+
+    def _refresh(self):
+        try:
+            with span('tmdb.upcoming'):
+                upcoming_movies_json = tmdb_get('/movie/upcoming').get('results', [])
+        except (TMDBError, ValueError) as e:
+            print(f"Error fetching upcoming movies: {e}")
+            self._next_refresh = time.monotonic() + UPCOMING_RETRY_SECONDS
+            return
+        self._snapshot = _build_snapshot(upcoming_movies_json)
+        self._next_refresh = time.monotonic() + self.refresh_seconds
+
+    @timed('upcoming.match')
+    def match(self, mask, snapshot=None):
+        # Upcoming movies sharing at least one genre with mask, in feed order
+        if snapshot is None:
+            snapshot = self.snapshot()
+        return [snapshot.movies[position] for position in np.flatnonzero(snapshot.masks & mask)]
+
+
+upcoming_feed = UpcomingFeed()